@@ -0,0 +1,266 @@
+import asyncio
+import json
+import os
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import db
+from events import availability_hub
+from http_cache import make_etag
+
+
+# ============= СЕРВИС СВОБОДНЫХ ДАТ =============
+# Единая точка чтения/записи avalible_dates: её зовут и роуты FastAPI, и бот
+# (он работает в том же event loop, что и приложение).
+
+_SQL_CHUNK = 500  # не упираемся в лимит параметров SQLite
+
+
+async def _existing_slots(conn, dates: List[str]) -> set:
+    existing = set()
+    for i in range(0, len(dates), _SQL_CHUNK):
+        chunk = dates[i:i + _SQL_CHUNK]
+        cur = await conn.execute(
+            f"SELECT date, time FROM avalible_dates WHERE date IN ({','.join('?' * len(chunk))})",
+            chunk,
+        )
+        existing.update(await cur.fetchall())
+        await cur.close()
+    return existing
+
+
+async def _hidden_slots(conn, dates: List[str]) -> Tuple[set, set]:
+    """Забронированные слоты и закрытые дни среди dates — их посетители не видят"""
+    reserved, closed = set(), set()
+    for i in range(0, len(dates), _SQL_CHUNK):
+        chunk = dates[i:i + _SQL_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        cur = await conn.execute(f"SELECT date, time FROM reservations WHERE date IN ({marks})", chunk)
+        reserved.update(await cur.fetchall())
+        await cur.close()
+        cur = await conn.execute(f"SELECT date FROM bookings WHERE date IN ({marks})", chunk)
+        closed.update(d for (d,) in await cur.fetchall())
+        await cur.close()
+    return reserved, closed
+
+
+async def save(dates_times: Dict[str, Iterable[str]], replace: bool = False) -> Dict[str, int]:
+    """Записываем свободные слоты {дата: [время, ...]}.
+
+    replace=True — расписание на переданные даты заменяется целиком: слоты этих дат,
+    которых нет в запросе, удаляются (пустой список удаляет весь день).
+    """
+    slots = {(d, t) for d, times in dates_times.items() for t in times}
+    dates = sorted(dates_times)
+
+    # одна транзакция: читаем, что уже есть на эти даты, и пишем только разницу
+    async with db.write(db.BOOKING) as conn:
+        existing = await _existing_slots(conn, dates)
+        to_insert = sorted(slots - existing)
+        to_delete = sorted(existing - slots) if replace else []
+
+        if to_insert:
+            await conn.executemany(
+                "INSERT OR IGNORE INTO avalible_dates(date, time) VALUES (?, ?)",
+                to_insert
+            )
+        if to_delete:
+            await conn.executemany(
+                "DELETE FROM avalible_dates WHERE date = ? AND time = ?",
+                to_delete
+            )
+
+        if to_insert or to_delete:
+            reserved, closed = await _hidden_slots(conn, dates)
+            await bump_version(conn)
+
+    if to_insert or to_delete:
+        visible = lambda slot: slot not in reserved and slot[0] not in closed
+        notify(
+            added=[slot for slot in to_insert if visible(slot)],
+            removed=[slot for slot in to_delete if visible(slot)],
+        )
+    return {
+        "inserted": len(to_insert),
+        "removed": len(to_delete),
+        "unchanged": len(slots & existing),
+    }
+
+
+# ============= КЭШ СВОБОДНЫХ ДАТ =============
+# /bookings опрашивается каждой вкладкой раз в 20 секунд, а меняются данные только
+# при записи из бота. Держим уже сериализованный ответ + ETag в памяти процесса
+# (по одному на диапазон дат) и сбрасываем всё на каждой записи в avalible_dates.
+# Почти все запросы идут с диапазоном по умолчанию «с сегодня», так что кэш маленький.
+
+Range = Tuple[str, Optional[str]]  # (с какой даты, по какую включительно / None — без конца)
+
+CACHE_RANGES = 32
+
+_cached: Dict[Range, Tuple[bytes, str]] = {}  # диапазон -> (тело ответа JSON, ETag)
+_generation = 0                               # растёт на каждом invalidate()
+_rebuild_lock = asyncio.Lock()
+
+
+def invalidate() -> None:
+    global _generation
+    _generation += 1
+    _cached.clear()
+
+
+def _group(slots: Iterable[Tuple[str, str]]) -> Dict[str, List[str]]:
+    grouped: Dict[str, List[str]] = {}
+    for d, t in sorted(slots):
+        grouped.setdefault(d, []).append(t)
+    return grouped
+
+
+def notify(added: Iterable[Tuple[str, str]] = (), removed: Iterable[Tuple[str, str]] = ()) -> None:
+    """Видимые посетителям слоты изменились: сбрасываем кэш и шлём дельту в SSE"""
+    global _missed_foreign
+    if _missed_foreign:
+        # между нашими записями писал другой воркер — одной дельтой клиентов не догнать
+        _missed_foreign = False
+        notify_resync()
+        return
+    invalidate()
+    added, removed = _group(added), _group(removed)
+    if added or removed:
+        availability_hub.publish("delta", {"added": added, "removed": removed})
+
+
+def notify_resync() -> None:
+    """Изменение, которое проще переслать целиком (например, закрыт весь день)"""
+    global _missed_foreign
+    _missed_foreign = False
+    invalidate()
+    availability_hub.resync_all()
+
+
+# ============= СИНХРОНИЗАЦИЯ МЕЖДУ ВОРКЕРАМИ =============
+# Кэш и SSE-подписчики у каждого процесса свои. Любая запись расписания в своей
+# транзакции увеличивает meta.availability_version (bump_version). Фоновая задача
+# раз в SYNC_INTERVAL читает версию: если она обогнала нашу — писал другой воркер,
+# сбрасываем кэш и шлём подписчикам snapshot. Свои записи версию тоже двигают,
+# но мы узнаём новое значение ещё внутри транзакции и лишний resync не шлём.
+
+SYNC_INTERVAL = float(os.getenv("AVAILABILITY_SYNC_INTERVAL", 1.0))
+
+_known_version: Optional[int] = None  # последняя версия, которую этот процесс видел или записал
+_missed_foreign = False               # перед нашей записью была чужая, которую мы не видели
+_sync_task: Optional[asyncio.Task] = None
+
+
+async def bump_version(conn) -> None:
+    """Зовётся внутри транзакции записи в avalible_dates / reservations / bookings"""
+    global _known_version, _missed_foreign
+    cur = await conn.execute(
+        "UPDATE meta SET value = value + 1 WHERE key = 'availability_version' RETURNING value"
+    )
+    (version,) = await cur.fetchone()
+    await cur.close()
+    if _known_version is not None and version != _known_version + 1:
+        _missed_foreign = True
+    _known_version = version
+
+
+async def _current_version() -> int:
+    async with db.read(db.BOOKING) as conn:
+        cur = await conn.execute("SELECT value FROM meta WHERE key = 'availability_version'")
+        row = await cur.fetchone()
+        await cur.close()
+    return row[0] if row else 0
+
+
+async def _watch_version():
+    global _known_version
+    while True:
+        await asyncio.sleep(SYNC_INTERVAL)
+        try:
+            version = await _current_version()
+        except Exception as e:
+            print("[availability] не удалось прочитать версию расписания:", repr(e))
+            continue
+        # меньше нашей — это читатель ещё не видит наш же незакоммиченный bump
+        if version > _known_version:
+            _known_version = version
+            notify_resync()
+
+
+async def start() -> None:
+    global _known_version, _sync_task
+    if _sync_task is None:
+        _known_version = await _current_version()
+        _sync_task = asyncio.create_task(_watch_version())
+
+
+async def stop() -> None:
+    global _sync_task
+    if _sync_task is not None:
+        _sync_task.cancel()
+        await asyncio.gather(_sync_task, return_exceptions=True)
+        _sync_task = None
+
+
+def default_range() -> Range:
+    """Прошедшие дни посетителям не нужны: по умолчанию — с сегодня и дальше"""
+    return date.today().isoformat(), None
+
+
+async def load_grouped(date_range: Optional[Range] = None) -> Dict[str, List[str]]:
+    date_from, date_to = date_range or default_range()
+    # диапазон по date идёт через idx_avalible_dates_date
+    where, params = "a.date >= ?", [date_from]
+    if date_to is not None:
+        where += " AND a.date <= ?"
+        params.append(date_to)
+
+    async with db.read(db.BOOKING) as conn:
+        # занятые слоты и закрытые админом дни посетителям не показываем
+        cur = await conn.execute(
+            f"""
+            SELECT a.date, a.time FROM avalible_dates a
+            WHERE {where}
+              AND NOT EXISTS (SELECT 1 FROM reservations r WHERE r.date = a.date AND r.time = a.time)
+              AND NOT EXISTS (SELECT 1 FROM bookings b WHERE b.date = a.date)
+            ORDER BY a.date, a.time
+            """,
+            params,
+        )
+        rows = await cur.fetchall()
+        await cur.close()
+
+    dates_times: Dict[str, List[str]] = {}
+    for d, t in rows:
+        dates_times.setdefault(d, []).append(t)
+    return dates_times
+
+
+async def snapshot(date_range: Optional[Range] = None) -> Tuple[bytes, str]:
+    """Готовое тело ответа /bookings за диапазон и его ETag (из кэша или из БД)"""
+    key = date_range or default_range()
+
+    cached = _cached.get(key)
+    if cached is not None:
+        return cached
+
+    # одна пересборка на всех одновременных запросах
+    async with _rebuild_lock:
+        cached = _cached.get(key)
+        if cached is not None:
+            return cached
+
+        generation = _generation
+        body = json.dumps(
+            {"dates_times": await load_grouped(key)},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode()
+        result = (body, make_etag(body))
+
+        # пока читали, могла пройти запись — тогда не кладём устаревшее в кэш
+        if generation == _generation:
+            if len(_cached) >= CACHE_RANGES:
+                _cached.pop(next(iter(_cached)))  # самый старый диапазон
+            _cached[key] = result
+        return result
@@ -0,0 +1,84 @@
+"""Микробенчмарк рендера клавиатур бота (стоимость одного callback'а).
+
+Запуск из корня репозитория:
+    python -m bench.bench_keyboards
+"""
+import random
+import timeit
+
+from data import keyboards
+
+
+def _clear_caches():
+    keyboards.month_grid.cache_clear()
+    keyboards._header_rows.cache_clear()
+    keyboards._day_button.cache_clear()
+    keyboards._week_row.cache_clear()
+    keyboards._render_calendar.cache_clear()
+    keyboards._render_time_keyboard.cache_clear()
+
+
+def _report(name: str, seconds: float, number: int):
+    print(f"{name:<44} {seconds / number * 1e6:9.2f} µs/call")
+
+
+def main(number: int = 2000):
+    year, month = 2026, 11
+    selected = {f"{year:04d}-{month:02d}-{d:02d}" for d in random.sample(range(1, 31), 8)}
+    # плюс выбор в других месяцах — он не должен влиять на кэш
+    selected |= {f"2026-12-{d:02d}" for d in (1, 5, 9)}
+
+    # 1. холодный рендер: все кэши пустые (как до кэширования)
+    def cold():
+        _clear_caches()
+        keyboards.build_calendar(year, month, selected)
+
+    _report("build_calendar, cold (no caches)", timeit.timeit(cold, number=number), number)
+
+    # 2. повторное нажатие с тем же выбором (навигация туда-обратно, повтор callback'а)
+    _clear_caches()
+    keyboards.build_calendar(year, month, selected)
+    _report(
+        "build_calendar, warm (same selection)",
+        timeit.timeit(lambda: keyboards.build_calendar(year, month, selected), number=number),
+        number,
+    )
+
+    # 3. типичный callback: переключили один день — пересобирается одна неделя
+    days = list(range(1, 31))
+
+    def toggle():
+        day = random.choice(days)
+        date_str = f"{year:04d}-{month:02d}-{day:02d}"
+        selected.symmetric_difference_update({date_str})
+        keyboards.build_calendar(year, month, selected)
+
+    _report("build_calendar, toggle one day (incremental)", timeit.timeit(toggle, number=number), number)
+
+    # 4. листание месяцев
+    def navigate():
+        m = random.randint(1, 12)
+        keyboards.build_calendar(2026, m, selected)
+
+    _report("build_calendar, month navigation", timeit.timeit(navigate, number=number), number)
+
+    # 5. клавиатура времени
+    times = list(keyboards.TIMES)
+
+    def time_cold():
+        keyboards._render_time_keyboard.cache_clear()
+        keyboards.build_time_keyboard("2026-11-10", random.sample(times, 4))
+
+    def time_toggle():
+        keyboards.build_time_keyboard("2026-11-10", random.sample(times, random.randint(0, 2)))
+
+    _report("build_time_keyboard, cold", timeit.timeit(time_cold, number=number), number)
+    _report("build_time_keyboard, toggle (warm)", timeit.timeit(time_toggle, number=number), number)
+
+    print()
+    for name, info in keyboards.cache_info().items():
+        print(f"{name:<14} {info}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Локальная подмена Telegram Bot API для нагрузочных тестов.
+
+Отвечает на любые методы бота (sendMessage, editMessage*, ...), на getFile и
+на скачивание файла. Задержка, доля ответов 429 с retry_after и размер картинки
+настраиваются. Счётчики запросов — GET /_stats.
+
+Запуск из корня репозитория:
+    python -m bench.fake_telegram --port 8081 --latency-ms 80 --rate-429 0.05
+Приложение направляется на него через TELEGRAM_API_BASE=http://127.0.0.1:8081
+"""
+import argparse
+import asyncio
+import io
+import os
+import random
+from collections import Counter
+
+from fastapi import FastAPI, Request, Response
+
+LATENCY_MS = float(os.getenv("FAKE_TG_LATENCY_MS", 50))
+JITTER_MS = float(os.getenv("FAKE_TG_JITTER_MS", 20))
+RATE_429 = float(os.getenv("FAKE_TG_429_RATE", 0.0))
+RETRY_AFTER = int(os.getenv("FAKE_TG_RETRY_AFTER", 1))
+FILE_SIZE = int(os.getenv("FAKE_TG_FILE_SIZE", 1600))  # ширина тестовой картинки, px
+
+app = FastAPI()
+calls: Counter = Counter()
+_image: bytes = b""
+
+
+def _make_image(width: int) -> bytes:
+    from PIL import Image, ImageDraw
+
+    height = width * 3 // 4
+    image = Image.new("RGB", (width, height), (212, 165, 116))
+    draw = ImageDraw.Draw(image)
+    for i in range(0, width, 40):  # немного деталей, чтобы JPEG не был вырожденным
+        draw.line((i, 0, width - i, height), fill=(i % 255, 80, 160), width=3)
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+async def _delay():
+    await asyncio.sleep(max(0.0, LATENCY_MS + random.uniform(-JITTER_MS, JITTER_MS)) / 1000)
+
+
+def _too_many_requests():
+    return Response(
+        status_code=429,
+        media_type="application/json",
+        content=(
+            '{"ok":false,"error_code":429,"description":"Too Many Requests: retry after %d",'
+            '"parameters":{"retry_after":%d}}' % (RETRY_AFTER, RETRY_AFTER)
+        ),
+    )
+
+
+@app.get("/_stats")
+async def stats():
+    return dict(calls)
+
+
+@app.api_route("/file/bot{token}/{file_path:path}", methods=["GET"])
+async def download(token: str, file_path: str):
+    global _image
+
+    calls["file"] += 1
+    await _delay()
+    if not _image:
+        _image = _make_image(FILE_SIZE)
+    return Response(content=_image, media_type="image/jpeg")
+
+
+@app.api_route("/bot{token}/{method}", methods=["GET", "POST"])
+async def bot_method(token: str, method: str, request: Request):
+    calls[method] += 1
+    await _delay()
+
+    if RATE_429 and random.random() < RATE_429:
+        calls["429"] += 1
+        return _too_many_requests()
+
+    if method == "getFile":
+        file_id = request.query_params.get("file_id")
+        if file_id is None and request.method == "POST":
+            file_id = (await request.json()).get("file_id")
+        return {"ok": True, "result": {"file_id": file_id, "file_path": f"photos/{file_id}.jpg"}}
+
+    if method == "getMe":
+        # админ-бот (PTB) спрашивает это при старте
+        return {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}}
+
+    if method == "getUpdates":
+        await asyncio.sleep(1)  # «long polling» без апдейтов
+        return {"ok": True, "result": []}
+
+    if method == "sendMessage":
+        return {"ok": True, "result": {"message_id": calls[method], "date": 0, "chat": {"id": -100, "type": "supergroup"}}}
+
+    return {"ok": True, "result": True}
+
+
+def main():
+    global LATENCY_MS, JITTER_MS, RATE_429, RETRY_AFTER, FILE_SIZE
+
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=LATENCY_MS)
+    parser.add_argument("--jitter-ms", type=float, default=JITTER_MS)
+    parser.add_argument("--rate-429", type=float, default=RATE_429)
+    parser.add_argument("--retry-after", type=int, default=RETRY_AFTER)
+    parser.add_argument("--file-size", type=int, default=FILE_SIZE, help="ширина картинки в px")
+    args = parser.parse_args()
+
+    LATENCY_MS, JITTER_MS = args.latency_ms, args.jitter_ms
+    RATE_429, RETRY_AFTER, FILE_SIZE = args.rate_429, args.retry_after, args.file_size
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""Нагрузочный тест API на локальной подмене Telegram.
+
+Поднимает bench.fake_telegram и приложение (uvicorn main:app) на временных копиях БД,
+гоняет /data, /bookings, /get_card_info, /webhook и /your_available_dates на заданных
+уровнях параллельности и сохраняет p50/p95/p99, пропускную способность и память
+процесса приложения в JSON. С --compare сравнивает с прошлым прогоном.
+
+Запуск из корня репозитория:
+    python -m bench.loadtest --concurrency 1,10,50 --requests 300
+    python -m bench.loadtest --scenarios bookings,cards --compare bench/results/<прошлый>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "bench", "results")
+
+
+# ============= СЦЕНАРИИ =============
+# Сценарий — функция (номер запроса) -> параметры httpx.request.
+
+class Scenarios:
+    def __init__(self, start_day: date):
+        self.start_day = start_day
+        self.bookings_etag: Optional[str] = None
+        self.update_id = 10_000_000
+
+    def slot(self, i: int) -> tuple[str, str]:
+        # по 1440 минутных слотов в день — каждому заказу свой слот
+        day = self.start_day + timedelta(days=i // 1440)
+        minute = i % 1440
+        return day.isoformat(), f"{minute // 60:02d}:{minute % 60:02d}"
+
+    def data(self, i: int) -> dict:
+        day, t = self.slot(i)
+        return {"method": "POST", "url": "/data", "json": {
+            "name": f"Load Test {i}", "phone": "+10000000000", "day": day, "time": t,
+            "message": "load test",
+        }}
+
+    def bookings(self, i: int) -> dict:
+        return {"method": "GET", "url": "/bookings"}
+
+    def bookings_304(self, i: int) -> dict:
+        return {"method": "GET", "url": "/bookings", "headers": {"If-None-Match": self.bookings_etag or ""}}
+
+    def cards(self, i: int) -> dict:
+        return {"method": "GET", "url": "/get_card_info"}
+
+    def webhook(self, i: int) -> dict:
+        self.update_id += 1
+        return {"method": "POST", "url": "/webhook", "json": {
+            "update_id": self.update_id,
+            "message": {
+                "message_id": i,
+                "message_thread_id": int(os.environ["UPDATES_TOPIC_ID"]),
+                "caption": f"/add Load test card {i} @ generated by bench.loadtest",
+                "photo": [{"file_id": f"bench-{self.update_id}", "width": 1600, "height": 1200}],
+            },
+        }}
+
+    def available_dates(self, i: int) -> dict:
+        day = (self.start_day + timedelta(days=3650 + i)).isoformat()
+        return {"method": "POST", "url": "/your_available_dates", "json": {
+            "dates_times": {day: [f"{h:02d}:00" for h in range(8, 24)]},
+        }}
+
+
+SCENARIO_NAMES = ("bookings", "bookings_304", "cards", "available_dates", "data", "webhook")
+
+
+# ============= ПРОЦЕССЫ =============
+
+def _rss_mb(pid: int) -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+def _spawn(args: List[str], env: dict, log_path: Optional[str]) -> subprocess.Popen:
+    # вывод серверов — в файл, чтобы не мешал отчёту
+    log = open(log_path, "ab") if log_path else subprocess.DEVNULL
+    return subprocess.Popen([sys.executable, *args], cwd=REPO_ROOT, env=env,
+                            stdout=log, stderr=subprocess.STDOUT)
+
+
+async def _wait_ready(client: httpx.AsyncClient, url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} не поднялся за {timeout} сек")
+
+
+# ============= ПРОГОН =============
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+async def run_level(client: httpx.AsyncClient, make_request: Callable[[int], dict],
+                    concurrency: int, total: int, first: int, pid: int) -> dict:
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    counter = iter(range(first, first + total))
+    peak_rss = _rss_mb(pid)
+    rss_before = peak_rss
+    done = asyncio.Event()
+
+    async def sample_memory():
+        nonlocal peak_rss
+        while not done.is_set():
+            peak_rss = max(peak_rss, _rss_mb(pid))
+            await asyncio.sleep(0.1)
+
+    async def worker():
+        for i in counter:
+            request = make_request(i)
+            started = time.perf_counter()
+            try:
+                r = await client.request(**request)
+                statuses[r.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    sampler = asyncio.create_task(sample_memory())
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await sampler
+
+    latencies.sort()
+    ok = sum(n for code, n in statuses.items() if isinstance(code, int) and code < 400)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": ok,
+        "statuses": {str(k): v for k, v in sorted(statuses.items(), key=str)},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(latencies[-1], 2) if latencies else 0.0,
+            "mean": round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        },
+        "rss_mb": {
+            "before": round(rss_before, 1),
+            "after": round(_rss_mb(pid), 1),
+            "peak": round(peak_rss, 1),
+        },
+    }
+
+
+async def _wait_drained(client: httpx.AsyncClient, url: str, busy: Callable[[dict], bool],
+                        timeout: float = 120.0) -> Optional[float]:
+    """Сколько секунд фоновая обработка догоняла прогон (None — не успела за timeout)"""
+    started = time.monotonic()
+    while time.monotonic() - started < timeout:
+        if not busy((await client.get(url)).json()):
+            return round(time.monotonic() - started, 3)
+        await asyncio.sleep(0.1)
+    return None
+
+
+async def run(args, app_url: str, pid: int) -> List[dict]:
+    scenarios = Scenarios(start_day=date(2099, 1, 1))
+    levels = [int(c) for c in args.concurrency.split(",")]
+    names = [n for n in args.scenarios.split(",") if n]
+    results = []
+
+    limits = httpx.Limits(max_connections=max(levels) + 10, max_keepalive_connections=max(levels) + 10)
+    async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=60) as client:
+        await _wait_ready(client, "/bookings")
+
+        # слоты под заказы: каждому запросу /data — свой
+        if "data" in names:
+            need = args.requests * len(levels)
+            slots: Dict[str, List[str]] = {}
+            for i in range(need):
+                day, t = scenarios.slot(i)
+                slots.setdefault(day, []).append(t)
+            await client.post("/your_available_dates", json={"dates_times": slots})
+
+        for name in names:
+            if name not in SCENARIO_NAMES:
+                raise SystemExit(f"Неизвестный сценарий: {name}")
+            if name == "bookings_304":
+                scenarios.bookings_etag = (await client.get("/bookings")).headers.get("etag")
+
+            for n, level in enumerate(levels):
+                if name == "webhook":
+                    before = (await client.get("/webhook/stats")).json()
+                    handled_before = before["processed"] + before["failed"]
+
+                # номера запросов не пересекаются между уровнями — у /data свои слоты
+                result = await run_level(client, getattr(scenarios, name), level,
+                                         args.requests, n * args.requests, pid)
+
+                if name == "data":
+                    result["drain_s"] = await _wait_drained(
+                        client, "/outbox/stats", lambda s: s["pending"] or s["sending"])
+                elif name == "webhook":
+                    target = handled_before + result["ok"]
+                    result["drain_s"] = await _wait_drained(
+                        client, "/webhook/stats", lambda s: s["processed"] + s["failed"] < target)
+
+                result["scenario"] = name
+                results.append(result)
+                lat = result["latency_ms"]
+                print(f"{name:<16} c={level:<4} {result['throughput_rps']:>9.1f} rps  "
+                      f"p50={lat['p50']:>8.2f}  p95={lat['p95']:>8.2f}  p99={lat['p99']:>8.2f} ms  "
+                      f"rss={result['rss_mb']['peak']:.0f}MB  {result['statuses']}"
+                      + (f"  drain={result['drain_s']}s" if "drain_s" in result else ""))
+    return results
+
+
+# ============= СРАВНЕНИЕ С ПРОШЛЫМ ПРОГОНОМ =============
+
+def compare(current: List[dict], baseline_path: str, threshold: float) -> bool:
+    with open(baseline_path) as f:
+        baseline = {(r["scenario"], r["concurrency"]): r for r in json.load(f)["results"]}
+
+    regressed = False
+    print(f"\nСравнение с {baseline_path} (порог {threshold:.0%}):")
+    for r in current:
+        old = baseline.get((r["scenario"], r["concurrency"]))
+        if old is None:
+            continue
+        notes = []
+        for key in ("p50", "p95", "p99"):
+            before, after = old["latency_ms"][key], r["latency_ms"][key]
+            change = (after - before) / before if before else 0.0
+            notes.append(f"{key} {change:+.0%}")
+            if change > threshold:
+                regressed = True
+        change = (r["throughput_rps"] - old["throughput_rps"]) / old["throughput_rps"] if old["throughput_rps"] else 0.0
+        notes.append(f"rps {change:+.0%}")
+        if change < -threshold:
+            regressed = True
+        print(f"  {r['scenario']:<16} c={r['concurrency']:<4} " + "  ".join(notes))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test with a fake Telegram Bot API")
+    parser.add_argument("--scenarios", default=",".join(SCENARIO_NAMES))
+    parser.add_argument("--concurrency", default="1,10,50")
+    parser.add_argument("--requests", type=int, default=300, help="запросов на каждый уровень")
+    parser.add_argument("--app-port", type=int, default=8790)
+    parser.add_argument("--tg-port", type=int, default=8791)
+    parser.add_argument("--tg-latency-ms", type=float, default=50)
+    parser.add_argument("--tg-rate-429", type=float, default=0.0)
+    parser.add_argument("--tg-retry-after", type=int, default=1)
+    parser.add_argument("--server-log", help="куда писать вывод приложения и подмены Telegram")
+    parser.add_argument("--output", help="куда сохранить JSON (по умолчанию bench/results/)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--regression-threshold", type=float, default=0.15)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    for name in ("booking.db", "art-updates.db"):
+        shutil.copy(os.path.join(REPO_ROOT, "data", name), os.path.join(workdir, name))
+    os.makedirs(os.path.join(workdir, "media"))
+
+    env = dict(os.environ)
+    env.update({
+        "BOT_TOKEN": env.get("BOT_TOKEN") or "bench-token",
+        "GROUP_ID": env.get("GROUP_ID") or "-100",
+        "ORDERS_TOPIC_ID": env.get("ORDERS_TOPIC_ID") or "1",
+        "UPDATES_TOPIC_ID": env.get("UPDATES_TOPIC_ID") or "2",
+        "BOOKING_DB_PATH": os.path.join(workdir, "booking.db"),
+        "ART_DB_PATH": os.path.join(workdir, "art-updates.db"),
+        "MEDIA_DIR": os.path.join(workdir, "media"),
+        "TELEGRAM_API_BASE": f"http://127.0.0.1:{args.tg_port}",
+        "TG_HTTP2": "0",
+        "WEBHOOK_SECRET": "",
+    })
+    os.environ["UPDATES_TOPIC_ID"] = env["UPDATES_TOPIC_ID"]
+
+    fake_tg = _spawn(["-m", "bench.fake_telegram", "--port", str(args.tg_port),
+                      "--latency-ms", str(args.tg_latency_ms),
+                      "--rate-429", str(args.tg_rate_429),
+                      "--retry-after", str(args.tg_retry_after)], env, args.server_log)
+    app = _spawn(["-m", "uvicorn", "main:app", "--port", str(args.app_port), "--log-level", "warning"], env, args.server_log)
+
+    try:
+        results = asyncio.run(run(args, f"http://127.0.0.1:{args.app_port}", app.pid))
+    finally:
+        for proc in (app, fake_tg):
+            proc.terminate()
+            proc.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": commit,
+            "python": sys.version.split()[0],
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nРезультаты: {output}")
+
+    if args.compare and compare(results, args.compare, args.regression_threshold):
+        print("Есть регрессии")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Стресс-тест бронирования: много параллельных POST /data на одни и те же слоты.
+
+Проверяет, что каждый слот достаётся ровно одному заказу (остальные — 409),
+что на день, закрытый админом (/book), заказ не принимается вовсе,
+и меряет пропускную способность. Работает на временной копии БД, Telegram подменён.
+
+Запуск из корня репозитория:
+    python -m bench.stress_reservations --slots 20 --per-slot 50
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from collections import Counter
+
+
+def _prepare_env(workdir: str):
+    for name in ("booking.db", "art-updates.db"):
+        shutil.copy(os.path.join("data", name), os.path.join(workdir, name))
+    os.environ["BOOKING_DB_PATH"] = os.path.join(workdir, "booking.db")
+    os.environ["ART_DB_PATH"] = os.path.join(workdir, "art-updates.db")
+    for key, value in (("BOT_TOKEN", "TEST"), ("GROUP_ID", "-100"),
+                       ("ORDERS_TOPIC_ID", "1"), ("UPDATES_TOPIC_ID", "2")):
+        os.environ.setdefault(key, value)
+
+
+async def run(slots: int, per_slot: int, day: str):
+    from datetime import date, timedelta
+
+    import httpx
+
+    import availability
+    import main
+    import reservations
+    import tg_client
+
+    closed_day = (date.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+    fake_telegram = httpx.MockTransport(lambda request: httpx.Response(200, json={"ok": True}))
+
+    async with main.lifespan(main.app):
+        tg_client._client = httpx.AsyncClient(transport=fake_telegram)
+
+        times = [f"{h:02d}:{m:02d}" for h in range(24) for m in (0, 30)][:slots]
+        await availability.save({day: times, closed_day: times}, replace=True)
+        await reservations.book_days([closed_day])
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            async def order(t: str, i: int):
+                r = await client.post("/data", json={
+                    "name": f"Visitor {i}", "phone": "+100000000", "day": day, "time": t,
+                })
+                return t, r.status_code
+
+            jobs = [order(t, i) for i in range(per_slot) for t in times]
+            started = time.perf_counter()
+            results = await asyncio.gather(*jobs)
+            elapsed = time.perf_counter() - started
+
+            # слоты в avalible_dates есть, но день закрыт — все заказы должны получить 409
+            r = await client.post("/data", json={
+                "name": "Visitor", "phone": "+100000000", "day": closed_day, "time": times[0],
+            })
+            closed_status = r.status_code
+
+    statuses = Counter(code for _, code in results)
+    winners = Counter(t for t, code in results if code == 202)
+
+    print(f"requests: {len(results)}  time: {elapsed:.3f}s  throughput: {len(results) / elapsed:.0f} req/s")
+    print(f"statuses: {dict(statuses)}")
+
+    assert set(statuses) <= {202, 409}, f"unexpected statuses: {statuses}"
+    assert len(winners) == slots and all(n == 1 for n in winners.values()), f"double booking: {winners}"
+    print(f"OK: each of {slots} slots booked exactly once")
+
+    assert closed_status == 409, f"order on closed day {closed_day}: {closed_status}"
+    print(f"OK: closed day {closed_day} rejected with 409")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--slots", type=int, default=20)
+    parser.add_argument("--per-slot", type=int, default=50, help="параллельных заказов на один слот")
+    parser.add_argument("--day", default="2099-01-01")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="stress-reservations-")
+    try:
+        _prepare_env(workdir)
+        asyncio.run(run(args.slots, args.per_slot, args.day))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import os
+import time
+from typing import Awaitable, Callable, Optional
+
+import db
+
+
+# ============= АПДЕЙТЫ АДМИН-БОТА ДЛЯ ЛИДЕРА =============
+# В режиме BOT_MODE=webhook Telegram шлёт всё на /webhook, а запрос может попасть
+# в любой воркер. Бот (PTB Application) живёт только у лидера: у него апдейт сразу
+# уходит в application.update_queue, остальные воркеры кладут его в bot_inbox,
+# откуда лидер забирает апдейты каждые BOT_INBOX_POLL секунд.
+# Один воркер — всегда лидер, таблица не используется.
+
+POLL = float(os.getenv("BOT_INBOX_POLL", 0.2))
+BATCH_SIZE = 100
+
+Deliver = Callable[[dict], Awaitable[None]]
+
+_task: Optional[asyncio.Task] = None
+
+
+async def put(update: dict) -> None:
+    async with db.write(db.BOOKING) as conn:
+        await conn.execute(
+            "INSERT INTO bot_inbox (payload, received_at) VALUES (?, ?)",
+            (json.dumps(update, ensure_ascii=False), time.time()),
+        )
+
+
+async def _take() -> list:
+    async with db.read(db.BOOKING) as conn:
+        cur = await conn.execute("SELECT 1 FROM bot_inbox LIMIT 1")
+        empty = await cur.fetchone() is None
+        await cur.close()
+    if empty:
+        return []  # обычный случай — без захвата писателя
+
+    async with db.write(db.BOOKING) as conn:
+        cur = await conn.execute(
+            "DELETE FROM bot_inbox WHERE id IN (SELECT id FROM bot_inbox ORDER BY id LIMIT ?) "
+            "RETURNING id, payload",
+            (BATCH_SIZE,),
+        )
+        rows = await cur.fetchall()
+        await cur.close()
+    return sorted(rows)  # RETURNING порядок не гарантирует, а нажатия важно применить по очереди
+
+
+async def _run(deliver: Deliver):
+    while True:
+        try:
+            rows = await _take()
+        except Exception as e:
+            print("[bot_inbox] ошибка чтения:", repr(e))
+            rows = []
+
+        for _, payload in rows:
+            try:
+                await deliver(json.loads(payload))
+            except Exception as e:
+                print("[bot_inbox] апдейт не передан боту:", repr(e))
+
+        if len(rows) < BATCH_SIZE:
+            await asyncio.sleep(POLL)
+
+
+async def start(deliver: Deliver) -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_run(deliver))
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
@@ -0,0 +1,134 @@
+import re
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import db
+
+
+# ============= КАРТОЧКИ ГАЛЕРЕИ (photos) =============
+
+CARD_FIELDS: Tuple[str, ...] = ("id", "title", "description", "photo_url", "variants")
+SQL_FIELDS = ("id", "title", "description", "photo_url")  # variants берутся из photo_variants
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def parse_fields(raw: str | None) -> Tuple[str, ...]:
+    """'title,photo_url' -> ('id', 'title', 'photo_url'); id нужен всегда — это курсор"""
+    if not raw:
+        return CARD_FIELDS
+
+    wanted = {f.strip() for f in raw.split(",") if f.strip()}
+    unknown = wanted - set(CARD_FIELDS)
+    if unknown:
+        raise ValueError(f"Неизвестные поля: {', '.join(sorted(unknown))}")
+
+    return tuple(f for f in CARD_FIELDS if f == "id" or f in wanted)
+
+
+async def photos_version() -> int:
+    """Версия таблицы photos (увеличивается триггерами на каждой записи)"""
+    async with db.read(db.ART) as conn:
+        cur = await conn.execute("SELECT value FROM meta WHERE key = 'photos_version'")
+        row = await cur.fetchone()
+        await cur.close()
+    return row[0] if row else 0
+
+
+async def _variants_for(conn, ids: List[int]) -> Dict[int, List[dict]]:
+    placeholders = ",".join("?" * len(ids))
+    cur = await conn.execute(
+        f"SELECT photo_id, format, width, height, url FROM photo_variants "
+        f"WHERE photo_id IN ({placeholders}) ORDER BY photo_id, format, width",
+        ids,
+    )
+    result: Dict[int, List[dict]] = {}
+    for photo_id, fmt, width, height, url in await cur.fetchall():
+        result.setdefault(photo_id, []).append(
+            {"format": fmt, "width": width, "height": height, "url": url}
+        )
+    await cur.close()
+    return result
+
+
+async def iter_page(after: int, limit: int, fields: Sequence[str]) -> AsyncIterator[dict]:
+    """Keyset-страница: карточки с id > after по возрастанию id.
+
+    Отдаёт до limit + 1 карточек — лишняя говорит о том, что есть следующая страница.
+    Строки читаются пачками, варианты картинок подтягиваются одним запросом на пачку.
+    """
+    columns = [f for f in fields if f in SQL_FIELDS]  # только из CARD_FIELDS, см. parse_fields
+    with_variants = "variants" in fields
+
+    async with db.read(db.ART) as conn:
+        cursor = await conn.execute(
+            f"SELECT {', '.join(columns)} FROM photos WHERE id > ? AND deleted_at IS NULL ORDER BY id LIMIT ?",
+            (after, limit + 1),
+        )
+        try:
+            while True:
+                rows = await cursor.fetchmany(64)
+                if not rows:
+                    break
+                items = [dict(zip(columns, row)) for row in rows]
+                if with_variants:
+                    variants = await _variants_for(conn, [item["id"] for item in items])
+                    for item in items:
+                        item["variants"] = variants.get(item["id"], [])
+                for item in items:
+                    yield item
+        finally:
+            await cursor.close()
+
+
+# ============= ПОИСК (FTS5) =============
+# photos_fts — внешний FTS5-индекс над photos.title/description (миграция ART v6).
+# Ввод пользователя в синтаксис FTS5 не пропускаем: берём только слова и ищем
+# каждое как префикс («sun» найдёт «sunset»). Сортировка — bm25, совпадение
+# в названии весит больше, чем в описании.
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_QUERY_TERMS = 16
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def fts_query(text: str) -> Optional[str]:
+    """'Sun set!' -> '"sun"* "set"*' (все слова обязательны); None — искать нечего"""
+    words = _WORD_RE.findall(text.lower())[:MAX_QUERY_TERMS]
+    if not words:
+        return None
+    return " ".join(f'"{w}"*' for w in words)
+
+
+async def search(text: str, limit: int, fields: Sequence[str]) -> List[dict]:
+    match = fts_query(text)
+    if match is None:
+        return []
+
+    columns = [f for f in fields if f in SQL_FIELDS]
+    async with db.read(db.ART) as conn:
+        cur = await conn.execute(
+            f"SELECT {', '.join('p.' + c for c in columns)} FROM photos_fts "
+            f"JOIN photos p ON p.id = photos_fts.rowid "
+            f"WHERE photos_fts MATCH ? AND p.deleted_at IS NULL "
+            f"ORDER BY bm25(photos_fts, 10.0, 1.0) LIMIT ?",
+            (match, limit),
+        )
+        items = [dict(zip(columns, row)) for row in await cur.fetchall()]
+        await cur.close()
+
+        if "variants" in fields and items:
+            variants = await _variants_for(conn, [item["id"] for item in items])
+            for item in items:
+                item["variants"] = variants.get(item["id"], [])
+    return items
+
+
+async def ids_by_title(title: str) -> List[int]:
+    """Точное совпадение названия (idx_photos_title)"""
+    async with db.read(db.ART) as conn:
+        cur = await conn.execute("SELECT id FROM photos WHERE title = ? AND deleted_at IS NULL", (title,))
+        ids = [row[0] for row in await cur.fetchall()]
+        await cur.close()
+    return ids
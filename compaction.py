@@ -0,0 +1,79 @@
+import asyncio
+import os
+from datetime import date, timedelta
+from typing import Dict, Optional
+
+import availability
+import db
+
+
+# ============= ЧИСТКА ПРОШЕДШИХ ДАТ =============
+# Слоты на прошедшие дни посетителю уже не показать, а закрытые админом дни
+# нужны только для недавней истории. Задача лидера раз в COMPACTION_INTERVAL
+# удаляет их пачками (короткие транзакции не держат писателя), затем
+# PRAGMA incremental_vacuum возвращает освободившиеся страницы ОС.
+# Брони (reservations) и outbox не трогаем — это история заказов.
+
+INTERVAL = float(os.getenv("COMPACTION_INTERVAL", 3600))
+BOOKINGS_RETENTION_DAYS = int(os.getenv("BOOKINGS_RETENTION_DAYS", 30))
+BATCH_SIZE = int(os.getenv("COMPACTION_BATCH", 1000))
+
+_task: Optional[asyncio.Task] = None
+
+
+async def _delete_before(table: str, cutoff: str) -> int:
+    """Удаляем строки table с date < cutoff пачками по BATCH_SIZE"""
+    deleted = 0
+    while True:
+        async with db.write(db.BOOKING) as conn:
+            cur = await conn.execute(
+                f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} WHERE date < ? LIMIT ?)",
+                (cutoff, BATCH_SIZE),
+            )
+            count = cur.rowcount
+            await cur.close()
+            if count:
+                await availability.bump_version(conn)
+        deleted += count
+        if count < BATCH_SIZE:
+            return deleted
+        await asyncio.sleep(0)  # даём пройти запросам между пачками
+
+
+async def run_once(today: Optional[date] = None) -> Dict[str, int]:
+    today = today or date.today()
+    slots = await _delete_before("avalible_dates", today.isoformat())
+    days = await _delete_before(
+        "bookings", (today - timedelta(days=BOOKINGS_RETENTION_DAYS)).isoformat()
+    )
+    if slots or days:
+        # в диапазонах с прошлым (/bookings?from=...) эти строки ещё видны
+        availability.notify_resync()
+
+    reclaimed = await db.vacuum(db.BOOKING)
+    if slots or days or reclaimed:
+        print(f"[compaction] удалено слотов: {slots}, закрытых дней: {days}, освобождено {reclaimed} байт")
+    return {"slots": slots, "bookings": days, "reclaimed_bytes": reclaimed}
+
+
+async def _run():
+    while True:
+        try:
+            await run_once()
+        except Exception as e:
+            print("[compaction] ошибка:", repr(e))
+        await asyncio.sleep(INTERVAL)
+
+
+async def start() -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
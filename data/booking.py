@@ -1,108 +1,26 @@
-import calendar
 import datetime
 import os
 from dotenv import load_dotenv
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update
 import time
 from collections import deque
 from telegram.ext import ContextTypes
 import asyncio
 from telegram.error import RetryAfter, TimedOut, BadRequest
-import aiohttp 
+import availability
+import metrics
+import recurring
+from data.keyboards import build_calendar, build_time_keyboard
 load_dotenv(".env")
 
 
-# ========== КАЛЕНДАРЬ (выбор дат) ==========
-
-def build_calendar(year: int, month: int, selected_dates: list[str] | None = None) -> InlineKeyboardMarkup:
-    if selected_dates is None:
-        selected_dates = []
-
-    keyboard: list[list[InlineKeyboardButton]] = []
-
-    # заголовок с месяцем
-    month_name = datetime.date(year, month, 1).strftime("%B %Y")
-    keyboard.append([InlineKeyboardButton(month_name, callback_data="IGNORE")])
-
-    # дни недели
-    keyboard.append([
-        InlineKeyboardButton(d, callback_data="IGNORE")
-        for d in ["Mo", "Tu", "We", "Th", "Fr", "Sa", "Su"]
-    ])
-
-    cal = calendar.Calendar(firstweekday=0)
-    month_days = cal.monthdayscalendar(year, month)
-
-    for week in month_days:
-        row: list[InlineKeyboardButton] = []
-        for day in week:
-            if day == 0:
-                row.append(InlineKeyboardButton(" ", callback_data="IGNORE"))
-            else:
-                date_str = f"{year:04d}-{month:02d}-{day:02d}"
-                text = f"✅{day}" if date_str in selected_dates else str(day)
-                row.append(
-                    InlineKeyboardButton(
-                        text,
-                        callback_data=f"DATE:{date_str}",
-                    )
-                )
-        keyboard.append(row)
-
-    # кнопка завершения выбора дат
-    keyboard.append([InlineKeyboardButton("Done", callback_data="DONE_DATES")])
-
-    return InlineKeyboardMarkup(keyboard)
-
-
-# ========== КЛАВА ВРЕМЕНИ ДЛЯ КОНКРЕТНОЙ ДАТЫ ==========
-
-def build_time_keyboard(date_str: str, selected_times: list[str] | None = None) -> InlineKeyboardMarkup:
-    if selected_times is None:
-        selected_times = []
-
-    # какие времена доступны
-    times = [
-        "08:00", "09:00", "10:00", "11:00",
-        "12:00", "13:00", "14:00", "15:00",
-        "16:00", "17:00", "18:00", "19:00",
-        "20:00", "21:00", "22:00", "23:00",
-    ]
-
-    keyboard: list[list[InlineKeyboardButton]] = []
-    row: list[InlineKeyboardButton] = []
-
-    for t in times:
-        # если уже выбрано – помечаем галкой
-        text = f"✅{t}" if t in selected_times else t
-        row.append(
-            InlineKeyboardButton(
-                text,
-                callback_data=f"TIME:{date_str}:{t}",
-            )
-        )
-        if len(row) == 3:
-            keyboard.append(row)
-            row = []
-
-    if row:
-        keyboard.append(row)
-
-    # кнопка "Готово с этой датой" — перейти к следующей дате
-    keyboard.append([InlineKeyboardButton("Set this date", callback_data="NEXT_DATE")])
-    keyboard.append([InlineKeyboardButton("Cancel", callback_data="CANCEL_ALL")])
-
-    return InlineKeyboardMarkup(keyboard)
-
-
-
-
-
+# ========== КЛАВИАТУРЫ ==========
+# build_calendar / build_time_keyboard живут в data/keyboards.py (с кэшем рендера)
 
 
 async def ask_time_for_current_date(query, context: ContextTypes.DEFAULT_TYPE):
     pending_dates: list[str] = context.user_data.get("pending_dates", [])
-    date_times: dict[str, list[str]] = context.user_data.get("date_times", {})
+    date_times: dict[str, set[str]] = context.user_data.get("date_times", {})
     current_index: int = context.user_data.get("current_index", 0)
 
     if current_index >= len(pending_dates):
@@ -118,25 +36,18 @@ async def ask_time_for_current_date(query, context: ContextTypes.DEFAULT_TYPE):
             lines.append(f"{d} — {times_str}")
         text = "Вы выбрали:\n" + "\n".join(lines)
 
-        # отправляем данные на бекенд
+        # пишем в БД напрямую через сервис (тот же процесс, без HTTP)
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    "http://localhost:8000/your_available_dates",
-                    json={"dates_times": date_times},
-                ) as res:
-                    if res.status == 200:
-                        text += "\n\nYour available days are set."
-                    else:
-                        text += f"\n\nServer returned status {res.status}."
+            await availability.save(date_times)
+            text += "\n\nYour available days are set."
         except Exception as e:
-            text += f"\n\nError while sending data: {e}"
+            text += f"\n\nError while saving data: {e}"
 
         await safe_edit_message_text(query, text)
         return
 
     current_date = pending_dates[current_index]
-    selected_times = date_times.get(current_date, [])
+    selected_times = date_times.get(current_date, set())
     markup = build_time_keyboard(current_date, selected_times)
 
     await safe_edit_message_text(
@@ -152,7 +63,7 @@ async def ask_time_for_current_date(query, context: ContextTypes.DEFAULT_TYPE):
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # очищаем состояние
-    context.user_data["selected_dates"] = []
+    context.user_data["selected_dates"] = set()
     context.user_data["pending_dates"] = []
     context.user_data["date_times"] = {}
     context.user_data["current_index"] = 0
@@ -164,15 +75,38 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def template(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # /template Mon-Fri 10:00-18:00 12w except 2025-06-12 — месяц слотов одной командой
+    try:
+        params = recurring.parse(update.message.text or "")
+        result = await recurring.apply(**params)
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+    except Exception as e:
+        await update.message.reply_text(f"Error while saving data: {e}")
+        return
+
+    if not result["dates"]:
+        await update.message.reply_text("No dates match this template.")
+        return
+    await update.message.reply_text(
+        f"Template applied: {result['dates']} days from {result['first']} to {result['last']}.\n"
+        f"Slots added: {result['inserted']}, removed: {result['removed']}, "
+        f"already set: {result['unchanged']}."
+    )
+
+
 async def handle_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     data = query.data
 
     await safe_answer_callback_query(query)
 
-    selected_dates: list[str] = context.user_data.get("selected_dates", [])
+    # выбор храним множествами: проверка и переключение за O(1)
+    selected_dates: set[str] = context.user_data.get("selected_dates", set())
     pending_dates: list[str] = context.user_data.get("pending_dates", [])
-    date_times: dict[str, list[str]] = context.user_data.get("date_times", {})
+    date_times: dict[str, set[str]] = context.user_data.get("date_times", {})
     current_index: int = context.user_data.get("current_index", 0)
 
     # --- выбор дат ---
@@ -182,7 +116,7 @@ async def handle_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if date_str in selected_dates:
             selected_dates.remove(date_str)
         else:
-            selected_dates.append(date_str)
+            selected_dates.add(date_str)
 
         context.user_data["selected_dates"] = selected_dates
 
@@ -190,6 +124,12 @@ async def handle_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
         markup = build_calendar(year, month, selected_dates)
         await safe_edit_message_reply_markup(query, reply_markup=markup)
 
+    # --- листаем месяцы («/») ---
+    elif data.startswith("MONTH:"):
+        year, month = map(int, data.split(":", 1)[1].split("-"))
+        markup = build_calendar(year, month, selected_dates)
+        await safe_edit_message_reply_markup(query, reply_markup=markup)
+
     elif data == "DONE_DATES":
         if not selected_dates:
             await safe_edit_message_text(query, "Nothing was chose.")
@@ -207,11 +147,11 @@ async def handle_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif data.startswith("TIME:"):
         _, date_str, time_str = data.split(":", 2)
 
-        times_for_date = date_times.get(date_str, [])
+        times_for_date = date_times.get(date_str, set())
         if time_str in times_for_date:
             times_for_date.remove(time_str)
         else:
-            times_for_date.append(time_str)
+            times_for_date.add(time_str)
         date_times[date_str] = times_for_date
         context.user_data["date_times"] = date_times
 
@@ -233,16 +173,90 @@ async def handle_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 
-# Очередь задач на редактирование: (bot, chat_id, message_id, "text"/"markup", payload, reply_markup)
-_edit_queue: deque[tuple] = deque()
-_edit_worker_running = False
+# ========== ПЛАНИРОВЩИК РЕДАКТИРОВАНИЙ ==========
+# Telegram ограничивает частоту сообщений в один чат (~1/сек) и для бота в целом (~30/сек).
+# Вместо одной глобальной очереди с паузой 1 сек между любыми правками:
+#  - у каждого чата свой token bucket и свой воркер, чаты друг друга не ждут;
+#  - правки одного сообщения склеиваются: уходит только последняя клавиатура/текст;
+#  - на RetryAfter ждём столько, сколько сказал Telegram, и шлём самую свежую версию.
+
+EDIT_RATE_PER_CHAT = float(os.getenv("EDIT_RATE_PER_CHAT", 1.0))  # правок в секунду на чат
+EDIT_BURST_PER_CHAT = int(os.getenv("EDIT_BURST_PER_CHAT", 3))
+EDIT_RATE_GLOBAL = float(os.getenv("EDIT_RATE_GLOBAL", 25.0))
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds: float):
+        # после RetryAfter: ничего не шлём, пока не выйдет время, и начинаем с пустым ведром
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+
+# правка: (bot, kind "text"/"markup", text, reply_markup, время постановки)
+_pending_edits: dict[tuple[int, int], tuple] = {}          # (chat_id, message_id) -> последняя правка
+_chat_queues: dict[int, deque[int]] = {}                    # chat_id -> message_id в порядке очереди
+_chat_workers: dict[int, asyncio.Task] = {}
+_chat_buckets: dict[int, _TokenBucket] = {}
+_global_bucket = _TokenBucket(EDIT_RATE_GLOBAL, int(EDIT_RATE_GLOBAL))
+
+
+def pending_edits() -> int:
+    """Сколько сообщений ждут отправки правки (после склейки)"""
+    return len(_pending_edits)
+
+
+edit_queue_depth = metrics.Gauge(
+    "telegram_edit_queue_depth", "Сообщения, ждущие отправки правки", callback=pending_edits)
+
+
+def _schedule_edit(bot, chat_id: int, message_id: int, kind: str, text, reply_markup):
+    key = (chat_id, message_id)
+    previous = _pending_edits.get(key)
+
+    if previous is None:
+        _chat_queues.setdefault(chat_id, deque()).append(message_id)
+        enqueued_at = time.monotonic()
+    else:
+        enqueued_at = previous[4]
+        if kind == "markup" and previous[1] == "text":
+            # ещё не отправленную смену текста терять нельзя — меняем в ней только клавиатуру
+            kind, text = "text", previous[2]
+
+    _pending_edits[key] = (bot, kind, text, reply_markup, enqueued_at)
+
+    worker = _chat_workers.get(chat_id)
+    if worker is None or worker.done():
+        _chat_workers[chat_id] = asyncio.create_task(_chat_edit_worker(chat_id))
 
-MIN_EDIT_INTERVAL = 1  
 
 async def safe_answer_callback_query(query):
     try:
         await query.answer()
     except RetryAfter as e:
+        metrics.telegram_rate_limited.inc("callback")
         await asyncio.sleep(e.retry_after)
         try:
             await query.answer()
@@ -262,78 +276,63 @@ async def safe_edit_message_reply_markup(query, reply_markup=None):
     if not query.message:
         return
 
-    bot = query.get_bot()
-    chat_id = query.message.chat_id
-    message_id = query.message.message_id
-
-    # kind="markup", payload можно оставить None
-    _edit_queue.append((bot, chat_id, message_id, "markup", None, reply_markup))
-
-    asyncio.create_task(_edit_worker())
-
+    _schedule_edit(query.get_bot(), query.message.chat_id, query.message.message_id,
+                   "markup", None, reply_markup)
 
 
 async def safe_edit_message_text(query, text: str, reply_markup=None):
     if not query.message:
         return
 
-    bot = query.get_bot()
-    chat_id = query.message.chat_id
-    message_id = query.message.message_id
-    _edit_queue.append((bot, chat_id, message_id, "text", text, reply_markup))# Кладём задачу в очередь: kind="text", payload=text
-    asyncio.create_task(_edit_worker())# Стартуем воркер, если он ещё не запущен
+    _schedule_edit(query.get_bot(), query.message.chat_id, query.message.message_id,
+                   "text", text, reply_markup)
 
 
+async def _send_edit(bot, chat_id: int, message_id: int, kind: str, text, reply_markup):
+    if kind == "text":
+        await bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=text,
+            reply_markup=reply_markup,
+        )
+    else:
+        await bot.edit_message_reply_markup(
+            chat_id=chat_id,
+            message_id=message_id,
+            reply_markup=reply_markup,
+        )
 
-async def _edit_worker():
-    global _edit_worker_running
-
-    if _edit_worker_running:
-        return  # уже запущен
 
-    _edit_worker_running = True
+async def _chat_edit_worker(chat_id: int):
+    bucket = _chat_buckets.setdefault(chat_id, _TokenBucket(EDIT_RATE_PER_CHAT, EDIT_BURST_PER_CHAT))
+    queue = _chat_queues.setdefault(chat_id, deque())
 
     try:
-        while _edit_queue:
-            bot, chat_id, message_id, kind, payload, reply_markup = _edit_queue.popleft()
+        while queue:
+            # сначала ждём токен, и только потом берём правку — пока ждали,
+            # новые нажатия успели склеиться в одну
+            await bucket.acquire()
+            await _global_bucket.acquire()
+
+            message_id = queue.popleft()
+            edit = _pending_edits.pop((chat_id, message_id), None)
+            if edit is None:
+                continue
+            bot, kind, text, reply_markup, enqueued_at = edit
+            metrics.edit_queue_wait.observe(time.monotonic() - enqueued_at)
 
             try:
-                if kind == "text":
-                    # payload = text
-                    await bot.edit_message_text(
-                        chat_id=chat_id,
-                        message_id=message_id,
-                        text=payload,
-                        reply_markup=reply_markup,
-                    )
-                elif kind == "markup":
-                    # payload игнорим, важно только reply_markup
-                    await bot.edit_message_reply_markup(
-                        chat_id=chat_id,
-                        message_id=message_id,
-                        reply_markup=reply_markup,
-                    )
+                await _send_edit(bot, chat_id, message_id, kind, text, reply_markup)
             except RetryAfter as e:
-                # если телега попросила подождать — ждём и пробуем ещё раз
-                print(f"[TG RetryAfter in _edit_worker]: waiting {e.retry_after} sec")
-                await asyncio.sleep(e.retry_after)
-                try:
-                    if kind == "text":
-                        await bot.edit_message_text(
-                            chat_id=chat_id,
-                            message_id=message_id,
-                            text=payload,
-                            reply_markup=reply_markup,
-                        )
-                    elif kind == "markup":
-                        await bot.edit_message_reply_markup(
-                            chat_id=chat_id,
-                            message_id=message_id,
-                            reply_markup=reply_markup,
-                        )
-                except Exception:
-                    # если и после повтора не вышло — просто пропускаем
-                    pass
+                # телега попросила подождать — блокируем чат и повторяем самую свежую версию
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                print(f"[TG RetryAfter in edit worker]: chat {chat_id}, waiting {retry_after} sec")
+                metrics.telegram_rate_limited.inc("edit")
+                bucket.block(retry_after)
+                if (chat_id, message_id) not in _pending_edits:
+                    _pending_edits[(chat_id, message_id)] = edit
+                    queue.appendleft(message_id)
             except BadRequest as e:
                 msg = str(e)
                 # типичные "не страшные" ошибки
@@ -343,12 +342,12 @@ async def _edit_worker():
                     pass
                 else:
                     # остальные BadRequest лучше увидеть в логах
-                    print("[TG BadRequest in _edit_worker]:", e)
+                    print("[TG BadRequest in edit worker]:", e)
             except TimedOut:
                 # телега не ответила — забили
                 pass
-
-            # пауза между запросами к Telegram, чтобы не ловить RetryAfter
-            await asyncio.sleep(MIN_EDIT_INTERVAL)
     finally:
-        _edit_worker_running = False
+        if _chat_workers.get(chat_id) is asyncio.current_task():
+            del _chat_workers[chat_id]
+        if not queue:
+            _chat_queues.pop(chat_id, None)
@@ -0,0 +1,116 @@
+import calendar
+import datetime
+from functools import lru_cache
+from typing import Iterable
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+# ========== РЕНДЕР КЛАВИАТУР (с кэшем) ==========
+# Кнопки и разметка в PTB неизменяемые, поэтому их можно спокойно переиспользовать.
+# Кэшируется всё по слоям: сетка месяца, отдельные кнопки, строки-недели и
+# готовая разметка по (месяц, выбранные дни месяца). Нажатие на день меняет одну
+# неделю — остальные строки и заголовки берутся из кэша.
+
+WEEKDAYS = ("Mo", "Tu", "We", "Th", "Fr", "Sa", "Su")
+
+TIMES = (
+    "08:00", "09:00", "10:00", "11:00",
+    "12:00", "13:00", "14:00", "15:00",
+    "16:00", "17:00", "18:00", "19:00",
+    "20:00", "21:00", "22:00", "23:00",
+)
+TIMES_PER_ROW = 3
+
+_IGNORE = "IGNORE"
+_BLANK = InlineKeyboardButton(" ", callback_data=_IGNORE)
+_WEEKDAYS_ROW = tuple(InlineKeyboardButton(d, callback_data=_IGNORE) for d in WEEKDAYS)
+_DONE_ROW = (InlineKeyboardButton("Done", callback_data="DONE_DATES"),)
+_TIME_FOOTER = (
+    (InlineKeyboardButton("Set this date", callback_data="NEXT_DATE"),),
+    (InlineKeyboardButton("Cancel", callback_data="CANCEL_ALL"),),
+)
+
+
+def shift_month(year: int, month: int, delta: int) -> tuple[int, int]:
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+
+@lru_cache(maxsize=64)
+def month_grid(year: int, month: int) -> tuple[tuple[int, ...], ...]:
+    """Недели месяца (0 — день из соседнего месяца), считается один раз на месяц"""
+    return tuple(tuple(week) for week in calendar.Calendar(firstweekday=0).monthdayscalendar(year, month))
+
+
+@lru_cache(maxsize=64)
+def _header_rows(year: int, month: int) -> tuple[tuple[InlineKeyboardButton, ...], ...]:
+    month_name = datetime.date(year, month, 1).strftime("%B %Y")
+    prev_year, prev_month = shift_month(year, month, -1)
+    next_year, next_month = shift_month(year, month, 1)
+    return (
+        (
+            InlineKeyboardButton("«", callback_data=f"MONTH:{prev_year:04d}-{prev_month:02d}"),
+            InlineKeyboardButton(month_name, callback_data=_IGNORE),
+            InlineKeyboardButton("»", callback_data=f"MONTH:{next_year:04d}-{next_month:02d}"),
+        ),
+        _WEEKDAYS_ROW,
+    )
+
+
+@lru_cache(maxsize=2048)
+def _day_button(year: int, month: int, day: int, selected: bool) -> InlineKeyboardButton:
+    date_str = f"{year:04d}-{month:02d}-{day:02d}"
+    return InlineKeyboardButton(f"✅{day}" if selected else str(day), callback_data=f"DATE:{date_str}")
+
+
+@lru_cache(maxsize=1024)
+def _week_row(year: int, month: int, week: tuple[int, ...], selected: frozenset[int]) -> tuple[InlineKeyboardButton, ...]:
+    return tuple(
+        _BLANK if day == 0 else _day_button(year, month, day, day in selected)
+        for day in week
+    )
+
+
+@lru_cache(maxsize=256)
+def _render_calendar(year: int, month: int, selected: frozenset[int]) -> InlineKeyboardMarkup:
+    rows = list(_header_rows(year, month))
+    for week in month_grid(year, month):
+        rows.append(_week_row(year, month, week, selected.intersection(week)))
+    rows.append(_DONE_ROW)
+    return InlineKeyboardMarkup(rows)
+
+
+def selected_days(year: int, month: int, selected_dates: Iterable[str]) -> frozenset[int]:
+    """Из выбранных дат 'YYYY-MM-DD' оставляем дни нужного месяца"""
+    prefix = f"{year:04d}-{month:02d}-"
+    return frozenset(int(d[len(prefix):]) for d in selected_dates if d.startswith(prefix))
+
+
+def build_calendar(year: int, month: int, selected_dates: Iterable[str] | None = None) -> InlineKeyboardMarkup:
+    # ключ кэша — только дни этого месяца: выбор в других месяцах его не сбивает
+    return _render_calendar(year, month, selected_days(year, month, selected_dates or ()))
+
+
+@lru_cache(maxsize=1024)
+def _render_time_keyboard(date_str: str, selected: frozenset[str]) -> InlineKeyboardMarkup:
+    buttons = [
+        InlineKeyboardButton(f"✅{t}" if t in selected else t, callback_data=f"TIME:{date_str}:{t}")
+        for t in TIMES
+    ]
+    rows = [tuple(buttons[i:i + TIMES_PER_ROW]) for i in range(0, len(buttons), TIMES_PER_ROW)]
+    rows.extend(_TIME_FOOTER)
+    return InlineKeyboardMarkup(rows)
+
+
+def build_time_keyboard(date_str: str, selected_times: Iterable[str] | None = None) -> InlineKeyboardMarkup:
+    return _render_time_keyboard(date_str, frozenset(selected_times or ()))
+
+
+def cache_info() -> dict:
+    return {
+        "month_grid": month_grid.cache_info(),
+        "week_row": _week_row.cache_info(),
+        "calendar": _render_calendar.cache_info(),
+        "time_keyboard": _render_time_keyboard.cache_info(),
+    }
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import db
+
+
+# ============= СОСТОЯНИЕ МАСТЕРА АДМИН-БОТА В SQLITE =============
+# Мастер выбора дат/времени (data/booking.py) хранит выбор в context.user_data.
+# Чтобы рестарт или деплой не терял незаконченное расписание, user_data пишется
+# в booking.db (таблица bot_user_data) — но не из обработчика нажатия:
+#  - PTB раз в BOT_PERSIST_INTERVAL сам отдаёт user_data изменившихся пользователей,
+#    мы только кладём их в буфер (последняя версия на пользователя);
+#  - фоновая задача пишет весь буфер одной транзакцией, пока она пишет —
+#    новые изменения копятся и уйдут следующей пачкой;
+#  - при остановке бота (Application.shutdown -> flush) буфер дописывается.
+# При старте всё читается одним запросом, устаревшие мастера выбрасываются.
+
+PERSIST_INTERVAL = float(os.getenv("BOT_PERSIST_INTERVAL", 1.0))
+STATE_TTL = float(os.getenv("BOT_STATE_TTL", 7 * 24 * 3600))
+
+_SET = "$s"
+
+
+def _encode_value(value):
+    # множества — отсортированным списком с меткой, вложенные dict/list рекурсивно
+    if isinstance(value, (set, frozenset)):
+        return {_SET: sorted(value)}
+    if isinstance(value, dict):
+        return {str(k): _encode_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode_value(v) for v in value]
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if len(value) == 1 and _SET in value:
+            return set(value[_SET])
+        return {k: _decode_value(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode_value(v) for v in value]
+    return value
+
+
+def encode(data: dict) -> str:
+    """user_data -> компактный JSON: {"selected_dates":{"$s":["2025-05-01"]},...}"""
+    return json.dumps(_encode_value(data), ensure_ascii=False, separators=(",", ":"))
+
+
+def decode(raw: str) -> dict:
+    return _decode_value(json.loads(raw))
+
+
+class SQLitePersistence(BasePersistence):
+    """Только user_data; chat_data, bot_data, callback_data и разговоры не храним"""
+
+    def __init__(self, update_interval: float = PERSIST_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._dirty: Dict[int, Optional[str]] = {}  # user_id -> JSON, None — удалить
+        self._wake = asyncio.Event()
+        self._writing = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- чтение при старте ----------
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        cutoff = time.time() - STATE_TTL
+        async with db.write(db.BOOKING) as conn:
+            await conn.execute("DELETE FROM bot_user_data WHERE updated_at < ?", (cutoff,))
+            cur = await conn.execute("SELECT user_id, data FROM bot_user_data")
+            rows = await cur.fetchall()
+            await cur.close()
+
+        user_data = {}
+        for user_id, raw in rows:
+            try:
+                user_data[user_id] = decode(raw)
+            except ValueError as e:
+                print(f"[persistence] битое состояние пользователя {user_id}:", e)
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return user_data
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> dict:
+        return {}
+
+    # ---------- запись: только в буфер ----------
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        self._dirty[user_id] = encode(data) if data else None  # пустой (CANCEL_ALL) — удаляем
+        self._wake.set()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._dirty[user_id] = None
+        self._wake.set()
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key, new_state) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass  # в памяти всегда самая свежая версия — бот работает в одном процессе
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+    # ---------- фоновая запись ----------
+
+    async def _write_dirty(self) -> None:
+        async with self._writing:
+            batch, self._dirty = self._dirty, {}
+            if not batch:
+                return
+
+            now = time.time()
+            upserts = [(user_id, raw, now) for user_id, raw in batch.items() if raw is not None]
+            deletes = [(user_id,) for user_id, raw in batch.items() if raw is None]
+            try:
+                async with db.write(db.BOOKING) as conn:
+                    if upserts:
+                        await conn.executemany(
+                            "INSERT INTO bot_user_data (user_id, data, updated_at) VALUES (?, ?, ?) "
+                            "ON CONFLICT (user_id) DO UPDATE SET data = excluded.data, "
+                            "updated_at = excluded.updated_at",
+                            upserts,
+                        )
+                    if deletes:
+                        await conn.executemany("DELETE FROM bot_user_data WHERE user_id = ?", deletes)
+            except BaseException:
+                # не теряем (в том числе при отмене задачи): возвращаем в буфер, если нет версии новее
+                for user_id, raw in batch.items():
+                    self._dirty.setdefault(user_id, raw)
+                raise
+
+    async def _run(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            try:
+                await self._write_dirty()
+            except Exception as e:
+                print("[persistence] не удалось сохранить состояние бота:", repr(e))
+                await asyncio.sleep(PERSIST_INTERVAL)
+                self._wake.set()
+
+    async def flush(self) -> None:
+        """Вызывается из Application.shutdown: дописываем буфер и гасим задачу"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        try:
+            await self._write_dirty()
+        except Exception as e:
+            print("[persistence] состояние бота не сохранено при остановке:", repr(e))
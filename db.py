@@ -0,0 +1,452 @@
+import asyncio
+import os
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+import metrics
+
+
+# ============= ПУЛ СОЕДИНЕНИЙ SQLITE =============
+# Соединения открываются один раз в lifespan и живут до остановки приложения.
+# На каждую БД: одно соединение-писатель (под asyncio.Lock, транзакции
+# BEGIN IMMEDIATE) и несколько читателей. В WAL читатели не блокируют писателя.
+
+BOOKING = "booking"
+ART = "art"
+
+DB_PATHS: Dict[str, str] = {
+    BOOKING: os.getenv("BOOKING_DB_PATH", "data/booking.db"),
+    ART: os.getenv("ART_DB_PATH", "data/art-updates.db"),
+}
+
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",   # в WAL это безопасно и сильно дешевле FULL
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",     # ~8 МБ страничного кэша на соединение
+    "PRAGMA mmap_size = 67108864",
+    "PRAGMA foreign_keys = ON",
+]
+
+
+# ============= МИГРАЦИИ =============
+# (версия, список SQL). Номер применённой версии хранится в PRAGMA user_version,
+# каждая миграция выполняется один раз при старте, в своей транзакции.
+# Если список начинается с NO_TRANSACTION — без транзакции (VACUUM внутри неё нельзя).
+
+NO_TRANSACTION = "-- no transaction"
+
+MIGRATIONS: Dict[str, List[Tuple[int, List[str]]]] = {
+    BOOKING: [
+        (1, [
+            """
+            CREATE TABLE IF NOT EXISTS bookings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT UNIQUE
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS avalible_dates (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL,
+                time TEXT NOT NULL,
+                UNIQUE(date, time)
+            )
+            """,
+        ]),
+        (2, [
+            "CREATE INDEX IF NOT EXISTS idx_avalible_dates_date ON avalible_dates(date)",
+        ]),
+        (3, [
+            # исходящие сообщения в Telegram (заказы с сайта), см. outbox.py
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                method TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                sent_at REAL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(status, next_attempt_at)",
+        ]),
+        (4, [
+            # занятые слоты: UNIQUE(date, time) не даёт забронировать слот дважды, см. reservations.py
+            """
+            CREATE TABLE IF NOT EXISTS reservations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                date TEXT NOT NULL,
+                time TEXT NOT NULL,
+                order_id INTEGER REFERENCES outbox(id),
+                created_at REAL NOT NULL,
+                UNIQUE(date, time)
+            )
+            """,
+        ]),
+        (5, [
+            # аренда лидерства между воркерами (см. leader.py)
+            """
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """,
+            # версия расписания: по ней воркеры узнают о чужих записях (см. availability.py)
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+            """,
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('availability_version', 0)",
+        ]),
+        (6, [
+            # освобождённые страницы возвращаются ОС через PRAGMA incremental_vacuum
+            # (см. compaction.py); режим включается только полным VACUUM
+            NO_TRANSACTION,
+            "PRAGMA auto_vacuum = INCREMENTAL",
+            "VACUUM",
+        ]),
+        (7, [
+            # незаконченные мастера админ-бота (user_data), см. data/persistence.py
+            """
+            CREATE TABLE IF NOT EXISTS bot_user_data (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """,
+        ]),
+        (8, [
+            # апдейты бота, принятые не лидером (BOT_MODE=webhook), см. bot_inbox.py
+            """
+            CREATE TABLE IF NOT EXISTS bot_inbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                received_at REAL NOT NULL
+            )
+            """,
+        ]),
+    ],
+    ART: [
+        (1, [
+            """
+            CREATE TABLE IF NOT EXISTS photos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                description TEXT,
+                photo_url TEXT
+            )
+            """,
+        ]),
+        (2, [
+            "CREATE INDEX IF NOT EXISTS idx_photos_title ON photos(title)",
+        ]),
+        (3, [
+            # счётчик версий таблицы photos — из него считается ETag /get_card_info
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            )
+            """,
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('photos_version', 0)",
+            """
+            CREATE TRIGGER IF NOT EXISTS photos_version_ins AFTER INSERT ON photos BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'photos_version';
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS photos_version_upd AFTER UPDATE ON photos BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'photos_version';
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS photos_version_del AFTER DELETE ON photos BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'photos_version';
+            END
+            """,
+        ]),
+        (4, [
+            # уменьшенные копии фото (WebP/JPEG разных ширин), см. images.py
+            """
+            CREATE TABLE IF NOT EXISTS photo_variants (
+                photo_id INTEGER NOT NULL REFERENCES photos(id) ON DELETE CASCADE,
+                format TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                height INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                PRIMARY KEY (photo_id, format, width)
+            )
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS photo_variants_version_ins AFTER INSERT ON photo_variants BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'photos_version';
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS photo_variants_version_del AFTER DELETE ON photo_variants BEGIN
+                UPDATE meta SET value = value + 1 WHERE key = 'photos_version';
+            END
+            """,
+        ]),
+        (5, [
+            # update_id уже принятых webhook-апдейтов, см. ingest.py
+            """
+            CREATE TABLE IF NOT EXISTS processed_updates (
+                update_id INTEGER PRIMARY KEY,
+                received_at REAL NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_processed_updates_received ON processed_updates(received_at)",
+        ]),
+        (6, [
+            # полнотекстовый поиск по карточкам (см. cards.search); содержимое берётся
+            # из photos, индекс обновляют триггеры
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS photos_fts USING fts5(
+                title, description,
+                content = 'photos', content_rowid = 'id',
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS photos_fts_ins AFTER INSERT ON photos BEGIN
+                INSERT INTO photos_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS photos_fts_del AFTER DELETE ON photos BEGIN
+                INSERT INTO photos_fts (photos_fts, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS photos_fts_upd AFTER UPDATE OF title, description ON photos BEGIN
+                INSERT INTO photos_fts (photos_fts, rowid, title, description)
+                VALUES ('delete', old.id, old.title, old.description);
+                INSERT INTO photos_fts (rowid, title, description) VALUES (new.id, new.title, new.description);
+            END
+            """,
+            "INSERT INTO photos_fts (photos_fts) VALUES ('rebuild')",
+        ]),
+        (7, [
+            # части альбомов (media_group_id), ждущие остальных, см. ingest.py;
+            # в БД, а не в памяти — части одного альбома могут прийти в разные воркеры
+            """
+            CREATE TABLE IF NOT EXISTS album_parts (
+                media_group_id TEXT NOT NULL,
+                update_id INTEGER NOT NULL,
+                message TEXT NOT NULL,
+                received_at REAL NOT NULL,
+                PRIMARY KEY (media_group_id, update_id)
+            )
+            """,
+        ]),
+        (8, [
+            # мягкое удаление: /remove ставит метку, строку и файлы убирает media_gc.py
+            "ALTER TABLE photos ADD COLUMN deleted_at REAL",
+            "CREATE INDEX IF NOT EXISTS idx_photos_deleted ON photos(deleted_at) WHERE deleted_at IS NOT NULL",
+        ]),
+        (9, [
+            NO_TRANSACTION,
+            "PRAGMA auto_vacuum = INCREMENTAL",
+            "VACUUM",
+        ]),
+        (10, [
+            # подпись уже обработанного альбома — для частей, опоздавших к сборке (см. ingest.py)
+            """
+            CREATE TABLE IF NOT EXISTS album_captions (
+                media_group_id TEXT PRIMARY KEY,
+                caption TEXT NOT NULL,
+                flushed_at REAL NOT NULL
+            )
+            """,
+        ]),
+    ],
+}
+
+
+class Database:
+    def __init__(self, path: str, readers: int = 4, name: str = ""):
+        self.path = path
+        self.name = name or os.path.basename(path)
+        self.readers_count = readers
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._all: List[aiosqlite.Connection] = []
+        self._write_lock = asyncio.Lock()
+
+    async def _connect(self, readonly: bool = False) -> aiosqlite.Connection:
+        # isolation_level=None: транзакциями управляем сами (BEGIN IMMEDIATE в write())
+        conn = await aiosqlite.connect(self.path, isolation_level=None)
+        for pragma in PRAGMAS:
+            await conn.execute(pragma)
+        if readonly:
+            await conn.execute("PRAGMA query_only = ON")
+        self._all.append(conn)
+        return conn
+
+    async def open(self) -> None:
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+        self._writer = await self._connect()
+        for _ in range(self.readers_count):
+            self._readers.put_nowait(await self._connect(readonly=True))
+
+    async def close(self) -> None:
+        for conn in self._all:
+            await conn.close()
+        self._all.clear()
+        self._writer = None
+        self._readers = asyncio.Queue()
+
+    async def migrate(self, migrations: List[Tuple[int, List[str]]]) -> None:
+        # воркеров может быть несколько (см. leader.py) и стартуют они одновременно:
+        # версию перечитываем уже под BEGIN IMMEDIATE — миграцию, которую успел
+        # применить другой процесс, пропускаем
+        async with self._write_lock:
+            conn = self._writer
+            for version, statements in migrations:
+                await conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if await self._user_version(conn) >= version:
+                        await conn.execute("ROLLBACK")
+                        continue
+                    if statements and statements[0] == NO_TRANSACTION:
+                        await conn.execute("COMMIT")
+                        await self._migrate_no_transaction(conn, version, statements[1:])
+                        continue
+                    for sql in statements:
+                        await conn.execute(sql)
+                    await conn.execute(f"PRAGMA user_version = {int(version)}")
+                    await conn.execute("COMMIT")
+                except Exception:
+                    if conn.in_transaction:
+                        await conn.execute("ROLLBACK")
+                    raise
+                print(f"Миграция {self.path} -> v{version}")
+
+    async def _migrate_no_transaction(self, conn, version: int, statements: List[str]) -> None:
+        # VACUUM и т.п. вне транзакции: такие шаги должны быть идемпотентны — два
+        # воркера могут выполнить их одновременно, это лишь лишняя работа
+        for sql in statements:
+            await conn.execute(sql)
+        await conn.execute("BEGIN IMMEDIATE")
+        if await self._user_version(conn) < version:  # другой процесс мог уйти дальше
+            await conn.execute(f"PRAGMA user_version = {int(version)}")
+        await conn.execute("COMMIT")
+        print(f"Миграция {self.path} -> v{version}")
+
+    @staticmethod
+    async def _user_version(conn) -> int:
+        cur = await conn.execute("PRAGMA user_version")
+        (version,) = await cur.fetchone()
+        await cur.close()
+        return version
+
+    # наружу отдаём соединение в обёртке metrics.TimedConnection — время каждого запроса
+    # попадает в /metrics с метками (db, операция, таблица)
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        conn = await self._readers.get()
+        try:
+            yield metrics.TimedConnection(conn, self.name)
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        waiting_since = time.perf_counter()
+        async with self._write_lock:
+            metrics.db_write_lock_wait.observe(time.perf_counter() - waiting_since, self.name)
+            conn = metrics.TimedConnection(self._writer, self.name)
+            try:
+                # BEGIN внутри try: если задачу отменили на этом await, сам BEGIN
+                # всё равно выполнится в потоке aiosqlite — его надо откатить
+                await conn.execute("BEGIN IMMEDIATE")
+                yield conn
+            except BaseException:
+                try:
+                    await conn.execute("ROLLBACK")
+                except sqlite3.OperationalError:
+                    pass  # BEGIN так и не выполнился — откатывать нечего
+                raise
+            else:
+                await conn.execute("COMMIT")
+
+    async def _pragma_value(self, conn, pragma: str) -> int:
+        cur = await conn.execute(f"PRAGMA {pragma}")
+        (value,) = await cur.fetchone()
+        await cur.close()
+        return value
+
+    async def vacuum(self) -> int:
+        """Отдаём ОС свободные страницы (auto_vacuum = INCREMENTAL) и обрезаем WAL.
+
+        Возвращает, сколько байт стал меньше файл БД.
+        """
+        async with self._write_lock:
+            conn = metrics.TimedConnection(self._writer, self.name)
+            page_size = await self._pragma_value(conn, "page_size")
+            before = await self._pragma_value(conn, "page_count")
+            # execute() делает один шаг = одна страница; executescript гонит до конца
+            await conn.executescript("PRAGMA incremental_vacuum;")
+            after = await self._pragma_value(conn, "page_count")
+            cur = await conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            await cur.fetchall()
+            await cur.close()
+        return (before - after) * page_size
+
+
+_databases: Dict[str, Database] = {}
+
+
+async def init() -> None:
+    """Открываем все БД и прогоняем миграции (один раз, в lifespan)"""
+    readers = int(os.getenv("DB_READERS", 4))
+    for name, path in DB_PATHS.items():
+        if name in _databases:
+            continue
+        database = Database(path, readers=readers, name=name)
+        await database.open()
+        await database.migrate(MIGRATIONS.get(name, []))
+        _databases[name] = database
+
+
+async def close() -> None:
+    for database in _databases.values():
+        await database.close()
+    _databases.clear()
+
+
+def get(name: str) -> Database:
+    try:
+        return _databases[name]
+    except KeyError:
+        raise RuntimeError(f"БД {name!r} не открыта (db.init не вызывался)") from None
+
+
+def read(name: str):
+    return get(name).read()
+
+
+def write(name: str):
+    return get(name).write()
+
+
+async def vacuum(name: str) -> int:
+    return await get(name).vacuum()
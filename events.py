@@ -0,0 +1,132 @@
+import asyncio
+import json
+import os
+import random
+import secrets
+from collections import deque
+from typing import Deque, List, Optional, Set, Tuple
+
+import metrics
+
+
+# ============= SSE: РАССЫЛКА ИЗМЕНЕНИЙ РАСПИСАНИЯ =============
+# Каждый подписчик /bookings/stream — это asyncio.Queue с уже готовыми байтами событий.
+# Событие сериализуется один раз и раскладывается по всем очередям; heartbeat шлёт
+# одна общая задача, а не таймер на каждого клиента, поэтому тысячи простаивающих
+# подключений почти ничего не стоят. Последние события хранятся в кольцевом буфере —
+# по Last-Event-ID переподключившийся клиент получает только пропущенное.
+
+HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT", 15.0))
+HISTORY_SIZE = int(os.getenv("SSE_HISTORY", 256))
+SUBSCRIBER_QUEUE_SIZE = 64
+RETRY_MS = 5000
+# соединение не живёт дольше этого (±20%, чтобы клиенты не переподключались разом):
+# EventSource сам переподключится с Last-Event-ID, а кольцевой буфер отдаст пропущенное.
+# Иначе открытые вкладки держат uvicorn при остановке — он ждёт закрытия всех соединений
+# и не доходит до shutdown в lifespan
+MAX_STREAM_LIFETIME = float(os.getenv("SSE_MAX_LIFETIME", 300.0))
+
+RESYNC = object()  # «отправь клиенту свежий snapshot» (переполнение очереди, resync)
+_HEARTBEAT = b": ping\n\n"
+
+
+def stream_lifetime() -> float:
+    return MAX_STREAM_LIFETIME * random.uniform(0.8, 1.0)
+
+
+def format_event(event: str, data: bytes, event_id: Optional[str] = None) -> bytes:
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\n".encode() + b"data: " + data + b"\n\n"
+
+
+class Hub:
+    def __init__(self):
+        # id событий: <метка запуска>-<номер>; после рестарта старые id не совпадут
+        self.boot = secrets.token_hex(4)
+        self.last_seq = 0
+        self.history: Deque[Tuple[int, bytes]] = deque(maxlen=HISTORY_SIZE)
+        self.subscribers: Set[asyncio.Queue] = set()
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    @property
+    def last_id(self) -> str:
+        return f"{self.boot}-{self.last_seq}"
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self.subscribers.discard(queue)
+
+    def _offer(self, queue: asyncio.Queue, item) -> None:
+        try:
+            queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # клиент не успевает читать — выкидываем накопленное и шлём ему snapshot
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(RESYNC)
+
+    def publish(self, event: str, payload: dict) -> None:
+        self.last_seq += 1
+        message = format_event(
+            event,
+            json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode(),
+            self.last_id,
+        )
+        self.history.append((self.last_seq, message))
+        for queue in self.subscribers:
+            self._offer(queue, message)
+
+    def resync_all(self) -> None:
+        """Изменения, которые не выразить дельтой: всем подписчикам — новый snapshot"""
+        self.last_seq += 1
+        self.history.clear()  # дельты до этого момента уже не восстановят состояние
+        for queue in self.subscribers:
+            self._offer(queue, RESYNC)
+
+    def replay_since(self, last_event_id: Optional[str]) -> Optional[List[bytes]]:
+        """Пропущенные события после last_event_id или None, если нужен полный snapshot"""
+        if not last_event_id:
+            return None
+        boot, _, seq = last_event_id.partition("-")
+        if boot != self.boot or not seq.isdigit():
+            return None
+        seq = int(seq)
+        if seq == self.last_seq:
+            return []
+        if not self.history or seq < self.history[0][0] - 1 or seq > self.last_seq:
+            return None
+        return [message for s, message in self.history if s > seq]
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            for queue in self.subscribers:
+                if queue.empty():
+                    queue.put_nowait(_HEARTBEAT)
+
+    def start(self) -> None:
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self) -> None:
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+        # будим подписчиков, чтобы их генераторы завершились; переполненную
+        # очередь очищаем — None должен дойти до каждого
+        for queue in list(self.subscribers):
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+
+availability_hub = Hub()
+
+subscribers = metrics.Gauge(
+    "sse_subscribers", "Открытые подписки /bookings/stream",
+    callback=lambda: len(availability_hub.subscribers))
@@ -0,0 +1,20 @@
+import hashlib
+from typing import Optional
+
+
+# ============= ВАЛИДАТОРЫ HTTP-КЭША (ETag / If-None-Match) =============
+
+def make_etag(data: bytes) -> str:
+    """Сильный ETag из содержимого ответа"""
+    return '"' + hashlib.blake2b(data, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверяем заголовок If-None-Match (может быть списком или *)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip() for t in if_none_match.split(",")]
+    # для GET сравнение слабое: W/"x" совпадает с "x"
+    return any(t.removeprefix("W/") == etag.removeprefix("W/") for t in tags)
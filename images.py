@@ -0,0 +1,76 @@
+import asyncio
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+
+# ============= ПРЕВЬЮ КАРТИНОК (WebP / JPEG НЕСКОЛЬКИХ ШИРИН) =============
+# Ресайз — чистая нагрузка на CPU, поэтому он идёт в отдельном пуле процессов,
+# а event loop только ждёт результат. Имена производные от имени оригинала
+# (а оно — хэш содержимого): src/<hash>-640w.webp и т.д.
+
+VARIANT_WIDTHS = tuple(int(w) for w in os.getenv("IMAGE_VARIANT_WIDTHS", "320,640,1280").split(","))
+VARIANT_FORMATS = {"webp": ("WEBP", ".webp"), "jpeg": ("JPEG", ".jpg")}
+VARIANT_QUALITY = int(os.getenv("IMAGE_VARIANT_QUALITY", 80))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def start() -> None:
+    global _pool
+
+    if _pool is None:
+        # spawn, а не fork: в родителе уже крутятся потоки aiosqlite
+        _pool = ProcessPoolExecutor(
+            max_workers=int(os.getenv("IMAGE_WORKERS", 2)),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+
+def stop() -> None:
+    global _pool
+
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def render_variants(src_path: str) -> List[Dict]:
+    """Выполняется в процессе пула: режем оригинал на все ширины и форматы"""
+    from PIL import Image, ImageOps
+
+    folder = os.path.dirname(src_path)
+    stem = os.path.splitext(os.path.basename(src_path))[0]
+    variants: List[Dict] = []
+
+    with Image.open(src_path) as original:
+        image = ImageOps.exif_transpose(original).convert("RGB")
+
+    # шире оригинала не растягиваем; самый узкий вариант делаем всегда
+    widths = sorted({min(w, image.width) for w in VARIANT_WIDTHS})
+
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+
+        for fmt, (pil_format, ext) in VARIANT_FORMATS.items():
+            path = os.path.join(folder, f"{stem}-{width}w{ext}")
+            try:
+                os.utime(path)  # уже нарезано — переиспользуем, свежий mtime для media_gc
+            except FileNotFoundError:
+                # своё временное имя: одно и то же фото могут резать два воркера сразу
+                tmp_path = f"{path}.{os.getpid()}-{uuid.uuid4().hex[:8]}.part"
+                resized.save(tmp_path, pil_format, quality=VARIANT_QUALITY, optimize=True)
+                os.replace(tmp_path, path)
+            variants.append({"width": width, "height": height, "format": fmt, "url": path})
+
+    return variants
+
+
+async def make_variants(src_path: str) -> List[Dict]:
+    if _pool is None:
+        raise RuntimeError("Пул обработки картинок не запущен (images.start не вызывался)")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pool, render_variants, src_path)
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import db
+import metrics
+
+
+# ============= ПРИЁМ WEBHOOK-АПДЕЙТОВ =============
+# Webhook только проверяет апдейт, запоминает update_id (Telegram повторяет медленные
+# и неудачные доставки — повтор мы просто пропустим) и кладёт его в ограниченную
+# очередь. Обработку (/add, /remove, /book) делает пул воркеров. Если очередь полна,
+# отвечаем 503 — Telegram доставит апдейт позже (backpressure).
+#
+# Альбом (media group) Telegram присылает отдельными апдейтами — по одному на фото,
+# подпись обычно только у первого. Части копятся в album_parts, и когда новых нет
+# ALBUM_WAIT секунд, весь альбом уходит в очередь одним заданием. Подпись собранного
+# альбома запоминается в album_captions: часть, опоздавшая к сборке, соберётся
+# отдельно, но с той же подписью, и её фото не потеряется.
+
+QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4))
+DEDUP_TTL = 24 * 3600  # Telegram не повторяет апдейты дольше суток
+DRAIN_TIMEOUT = 10.0
+ALBUM_WAIT = float(os.getenv("ALBUM_WAIT", 1.5))
+ALBUM_CAPTION_TTL = 600  # столько помним подпись собранного альбома для опоздавших частей
+
+QUEUED, DUPLICATE, BUSY = "queued", "duplicate", "busy"
+
+Handler = Callable[[dict], Awaitable[None]]
+AlbumHandler = Callable[[List[dict]], Awaitable[None]]
+
+# задание в очереди: (обработчик, сообщение или список сообщений альбома, время постановки)
+_queue: Optional["asyncio.Queue[tuple[Callable, object, float]]"] = None
+_workers: List[asyncio.Task] = []
+_handler: Optional[Handler] = None
+_album_handler: Optional[AlbumHandler] = None
+_album_timers: Dict[str, asyncio.Task] = {}
+_stats: Dict[str, float] = {
+    "processed": 0, "failed": 0, "duplicates": 0, "rejected": 0, "albums": 0, "max_wait": 0.0,
+}
+_remembered = 0
+
+queue_depth = metrics.Gauge(
+    "webhook_queue_depth", "Апдейты в очереди на обработку",
+    callback=lambda: _queue.qsize() if _queue is not None else 0)
+queue_wait = metrics.Histogram("webhook_queue_wait_seconds", "Сколько апдейт ждал воркера")
+
+
+async def _remember(update_id: int, conn) -> bool:
+    """True — апдейт новый; False — уже видели (в транзакции conn)"""
+    global _remembered
+
+    now = time.time()
+    cur = await conn.execute(
+        "INSERT OR IGNORE INTO processed_updates (update_id, received_at) VALUES (?, ?)",
+        (update_id, now),
+    )
+    is_new = cur.rowcount == 1
+    await cur.close()
+
+    _remembered += 1
+    if _remembered % 1000 == 0:
+        await conn.execute("DELETE FROM processed_updates WHERE received_at < ?", (now - DEDUP_TTL,))
+    return is_new
+
+
+async def _forget(update_id: int) -> None:
+    async with db.write(db.ART) as conn:
+        await conn.execute("DELETE FROM processed_updates WHERE update_id = ?", (update_id,))
+
+
+async def accept(update: dict, payload: Optional[dict] = None) -> str:
+    """Ставим апдейт в очередь. payload — то, что получит обработчик (по умолчанию сам апдейт)"""
+    if _queue is None:
+        raise RuntimeError("Очередь webhook не запущена (ingest.start не вызывался)")
+
+    if _queue.full():
+        _stats["rejected"] += 1
+        return BUSY
+
+    update_id = update.get("update_id")
+    if update_id is not None:
+        async with db.write(db.ART) as conn:
+            is_new = await _remember(update_id, conn)
+        if not is_new:
+            _stats["duplicates"] += 1
+            return DUPLICATE
+
+    try:
+        _queue.put_nowait((_handler, payload if payload is not None else update, time.monotonic()))
+    except asyncio.QueueFull:
+        # пока писали update_id, очередь заполнилась — забываем его, чтобы повтор прошёл
+        if update_id is not None:
+            await _forget(update_id)
+        _stats["rejected"] += 1
+        return BUSY
+    return QUEUED
+
+
+async def accept_album_part(update: dict, message: dict) -> str:
+    """Часть альбома: запоминаем в album_parts, альбом целиком обработается позже"""
+    if _queue is None:
+        raise RuntimeError("Очередь webhook не запущена (ingest.start не вызывался)")
+
+    if _queue.full():
+        _stats["rejected"] += 1
+        return BUSY
+
+    group_id = str(message["media_group_id"])
+    update_id = update.get("update_id", message.get("message_id"))
+    async with db.write(db.ART) as conn:
+        if update.get("update_id") is not None and not await _remember(update_id, conn):
+            is_new = False
+        else:
+            await conn.execute(
+                "INSERT OR IGNORE INTO album_parts (media_group_id, update_id, message, received_at) "
+                "VALUES (?, ?, ?, ?)",
+                (group_id, update_id, json.dumps(message, ensure_ascii=False), time.time()),
+            )
+            is_new = True
+    if not is_new:
+        _stats["duplicates"] += 1
+        return DUPLICATE
+
+    _schedule_album(group_id)
+    return QUEUED
+
+
+def _schedule_album(group_id: str) -> None:
+    timer = _album_timers.get(group_id)
+    if timer is None or timer.done():
+        _album_timers[group_id] = asyncio.create_task(_flush_album(group_id))
+
+
+async def _flush_album(group_id: str):
+    """Ждём, пока части альбома перестанут приходить, и забираем их все разом"""
+    try:
+        while True:
+            await asyncio.sleep(ALBUM_WAIT)
+            async with db.write(db.ART) as conn:
+                cur = await conn.execute(
+                    "SELECT MAX(received_at) FROM album_parts WHERE media_group_id = ?", (group_id,)
+                )
+                (last,) = await cur.fetchone()
+                await cur.close()
+                if last is None:
+                    return  # альбом уже забрал другой воркер
+                if time.time() - last < ALBUM_WAIT:
+                    continue
+
+                cur = await conn.execute(
+                    "DELETE FROM album_parts WHERE media_group_id = ? RETURNING message", (group_id,)
+                )
+                parts = [json.loads(message) for (message,) in await cur.fetchall()]
+                await cur.close()
+                parts.sort(key=lambda m: m.get("message_id", 0))
+                await _share_caption(conn, group_id, parts)
+            break
+
+        _stats["albums"] += 1
+        # на апдейты уже ответили 200 — ждём место в очереди, а не отказываем
+        await _queue.put((_album_handler, parts, time.monotonic()))
+    except Exception as e:
+        print(f"[webhook] альбом {group_id}: {e!r}")
+    finally:
+        if _album_timers.get(group_id) is asyncio.current_task():
+            del _album_timers[group_id]
+
+
+def _caption(message: dict) -> str:
+    return (message.get("caption") or message.get("text") or "").strip()
+
+
+async def _share_caption(conn, group_id: str, parts: List[dict]) -> None:
+    """Запоминаем подпись альбома или берём сохранённую, если это опоздавшие части"""
+    now = time.time()
+    await conn.execute("DELETE FROM album_captions WHERE flushed_at < ?", (now - ALBUM_CAPTION_TTL,))
+
+    caption = next((c for c in map(_caption, parts) if c), "")
+    if caption:
+        await conn.execute(
+            "INSERT INTO album_captions (media_group_id, caption, flushed_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (media_group_id) DO UPDATE SET caption = excluded.caption, "
+            "flushed_at = excluded.flushed_at",
+            (group_id, caption, now),
+        )
+        return
+
+    cur = await conn.execute(
+        "SELECT caption FROM album_captions WHERE media_group_id = ?", (group_id,)
+    )
+    row = await cur.fetchone()
+    await cur.close()
+    if row and parts:
+        parts[0]["caption"] = row[0]  # обработчик возьмёт её как подпись альбома
+
+
+def stats() -> Dict[str, float]:
+    return {
+        "depth": _queue.qsize() if _queue is not None else 0,
+        "maxsize": QUEUE_SIZE,
+        "workers": len(_workers),
+        "albums_pending": len(_album_timers),
+        **_stats,
+    }
+
+
+async def _worker():
+    while True:
+        handler, item, enqueued_at = await _queue.get()
+        waited = time.monotonic() - enqueued_at
+        _stats["max_wait"] = max(_stats["max_wait"], waited)
+        queue_wait.observe(waited)
+        try:
+            await handler(item)
+            _stats["processed"] += 1
+        except Exception as e:
+            _stats["failed"] += 1
+            print("[webhook] ошибка обработки апдейта:", repr(e))
+        finally:
+            _queue.task_done()
+
+
+async def start(handler: Handler, album_handler: AlbumHandler) -> None:
+    global _queue, _handler, _album_handler
+
+    if _queue is not None:
+        return
+
+    _handler, _album_handler = handler, album_handler
+    _queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    _workers.extend(asyncio.create_task(_worker()) for _ in range(WORKERS))
+
+    # альбомы, недособранные до рестарта, досылаем
+    async with db.read(db.ART) as conn:
+        cur = await conn.execute("SELECT DISTINCT media_group_id FROM album_parts")
+        for (group_id,) in await cur.fetchall():
+            _schedule_album(group_id)
+        await cur.close()
+
+
+async def stop() -> None:
+    global _queue
+
+    if _queue is None:
+        return
+
+    # недособранные альбомы останутся в album_parts — их подберёт следующий запуск
+    for timer in list(_album_timers.values()):
+        timer.cancel()
+    await asyncio.gather(*_album_timers.values(), return_exceptions=True)
+    _album_timers.clear()
+
+    # даём воркерам дообработать то, что уже принято (на эти апдейты мы ответили 200)
+    try:
+        await asyncio.wait_for(_queue.join(), DRAIN_TIMEOUT)
+    except asyncio.TimeoutError:
+        print(f"[webhook] при остановке не обработано апдейтов: {_queue.qsize()}")
+
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    _queue = None
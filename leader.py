@@ -0,0 +1,139 @@
+import asyncio
+import os
+import secrets
+import socket
+import time
+from typing import Awaitable, Callable, Optional
+
+import db
+
+
+# ============= ЛИДЕР СРЕДИ ВОРКЕРОВ =============
+# HTTP API можно запускать в N процессах (uvicorn --workers N / gunicorn), но бот
+# и фоновые задачи (outbox, обслуживание БД) должны крутиться ровно в одном.
+# Лидерство — аренда в SQLite с TTL: лидер продлевает её каждые TTL/3, остальные
+# с той же частотой пробуют её забрать. Умер лидер — через TTL аренда истекает
+# и её подхватывает другой воркер. При штатной остановке аренда отпускается сразу.
+# Один процесс — просто всегда лидер.
+
+LEASE_NAME = "leader"
+LEASE_TTL = float(os.getenv("LEADER_TTL", 15.0))
+RENEW_INTERVAL = LEASE_TTL / 3
+
+HOLDER = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+Callback = Callable[[], Awaitable[None]]
+
+_task: Optional[asyncio.Task] = None
+_jobs_task: Optional[asyncio.Task] = None  # запуск задач лидера (on_elected)
+_on_elected: Optional[Callback] = None
+_on_demoted: Optional[Callback] = None
+_is_leader = False
+_lease_until = 0.0  # до какого момента (monotonic) аренда точно наша
+
+
+def is_leader() -> bool:
+    return _is_leader
+
+
+async def _try_acquire() -> bool:
+    """Берём свободную/просроченную аренду или продлеваем свою"""
+    now = time.time()
+    async with db.write(db.BOOKING) as conn:
+        cur = await conn.execute(
+            """
+            INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+            WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+            """,
+            (LEASE_NAME, HOLDER, now + LEASE_TTL, now),
+        )
+        acquired = cur.rowcount == 1
+        await cur.close()
+    return acquired
+
+
+async def _release() -> None:
+    async with db.write(db.BOOKING) as conn:
+        await conn.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (LEASE_NAME, HOLDER))
+
+
+async def _start_jobs() -> None:
+    try:
+        await _on_elected()
+    except Exception as e:
+        print("[leader] не удалось запустить задачи лидера:", repr(e))
+        await _demote()
+        await _release()
+
+
+async def _elect() -> None:
+    # задачи лидера (бот: initialize/setWebhook — это запросы в Telegram) запускаем
+    # отдельной задачей: пока они стартуют, _run продолжает продлевать аренду,
+    # иначе медленный старт дольше TTL отдал бы лидерство второму воркеру
+    global _is_leader, _jobs_task
+    _is_leader = True
+    print(f"[leader] {HOLDER} стал лидером")
+    _jobs_task = asyncio.create_task(_start_jobs())
+
+
+async def _demote() -> None:
+    global _is_leader, _jobs_task
+    if not _is_leader:
+        return
+    _is_leader = False
+    print(f"[leader] {HOLDER} больше не лидер")
+
+    jobs_task, _jobs_task = _jobs_task, None
+    if jobs_task is not None and jobs_task is not asyncio.current_task() and not jobs_task.done():
+        jobs_task.cancel()  # ещё запускаемся — прерываем, on_demoted остановит то, что успело стартовать
+        await asyncio.gather(jobs_task, return_exceptions=True)
+    try:
+        await _on_demoted()
+    except Exception as e:
+        print("[leader] ошибка при остановке задач лидера:", repr(e))
+
+
+async def _run():
+    global _lease_until
+    while True:
+        started = time.monotonic()
+        try:
+            acquired = await _try_acquire()
+        except Exception as e:
+            print("[leader] не удалось продлить аренду:", repr(e))
+            acquired = None
+
+        if acquired:
+            _lease_until = started + LEASE_TTL
+            if not _is_leader:
+                await _elect()
+        elif acquired is False or time.monotonic() >= _lease_until:
+            # аренду забрал другой, или мы не смогли её продлить до истечения
+            await _demote()
+
+        await asyncio.sleep(RENEW_INTERVAL)
+
+
+async def start(on_elected: Callback, on_demoted: Callback) -> None:
+    """on_elected/on_demoted запускают и останавливают всё, что должно работать в одном процессе"""
+    global _task, _on_elected, _on_demoted
+    if _task is None:
+        _on_elected, _on_demoted = on_elected, on_demoted
+        _task = asyncio.create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is None:
+        return
+    _task.cancel()
+    await asyncio.gather(_task, return_exceptions=True)
+    _task = None
+
+    if _is_leader:
+        await _demote()
+        try:
+            await _release()  # следующий лидер не ждёт TTL
+        except Exception as e:
+            print("[leader] не удалось отпустить аренду:", repr(e))
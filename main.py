@@ -1,15 +1,38 @@
+import asyncio
+import hashlib
 import os
 import re
+import tempfile
+import time
+from contextlib import aclosing, asynccontextmanager
 from datetime import date
-from typing import Dict, List, Optional
+from typing import Annotated, Dict, List, Optional
+import json
 import anyio
-import httpx
-import aiosqlite
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 from dotenv import load_dotenv
 
+import availability
+import bot_inbox
+import cards
+import compaction
+import db
+import events
+import images
+import ingest
+import leader
+import media
+import media_gc
+import metrics
+import outbox
+import recurring
+import reservations
+import tg_client
+from http_cache import etag_matches, make_etag
+
 
 # =============== LOAD TOKENS =======================
 load_dotenv(".env")
@@ -17,9 +40,40 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 GROUP_ID = os.getenv("GROUP_ID")
 ORDERS_TOPIC_ID = int(os.getenv("ORDERS_TOPIC_ID"))
 UPDATES_TOPIC_ID = int(os.getenv("UPDATES_TOPIC_ID"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # secret_token из setWebhook (необязательно)
+# админ-бот работает в процессе-лидере: polling — сам опрашивает getUpdates,
+# webhook — получает апдейты через /webhook этого же сервера; off — бота нет
+BOT_MODE = os.getenv("BOT_MODE", "off")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # если задан, в режиме webhook бот сам вызывает setWebhook
 # ===================================================
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # общий HTTP-клиент к Telegram и пул соединений к БД живут столько же, сколько приложение
+    metrics.start()
+    await db.init()
+    await tg_client.start(BOT_TOKEN)
+    images.start()
+    await ingest.start(process_update, process_album)
+    events.availability_hub.start()
+    await availability.start()
+    # бот, outbox и чистка БД — только в одном воркере из N (см. leader.py)
+    await leader.start(start_leader_jobs, stop_leader_jobs)
+    try:
+        yield
+    finally:
+        await leader.stop()
+        await availability.stop()
+        await events.availability_hub.stop()
+        await ingest.stop()
+        images.stop()
+        await tg_client.close()
+        await db.close()
+        await metrics.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,6 +85,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(metrics.HTTPMetricsMiddleware)
 
 
 # ============= HELPERS ==========================
@@ -50,9 +105,31 @@ class SimpleBooking(BaseModel):
     message: Optional[str] = Field(None, max_length=300)
 
 
+SlotTime = Annotated[str, Field(pattern=r"^([01]\d|2[0-3]):[0-5]\d$")]  # "10:00"
+
+
+class AvailableDates(BaseModel):
+    # replace=True удаляет слоты — кривой ввод должен отсекаться до save (422)
+    dates_times: Dict[date, List[SlotTime]] = {}
+    replace: bool = False
+
+
+class AvailabilityTemplate(BaseModel):
+    weekdays: List[int] = Field(..., min_length=1, description="0 — понедельник")
+    start_time: str = Field(..., examples=["10:00"])
+    end_time: str = Field(..., examples=["18:00"], description="не включается")
+    weeks: int = Field(recurring.DEFAULT_WEEKS, ge=1, le=recurring.MAX_WEEKS)
+    start: Optional[date] = None
+    except_dates: List[date] = []
+    replace: bool = False
+
+
 # ============= SEND TO TELEGRAM (ASYNC) =============
+# Слот занимается атомарно вместе с записью заказа в outbox (см. reservations.py),
+# заказ доставляется фоновым воркером (см. outbox.py) — посетитель не ждёт Telegram,
+# а двое на один слот не попадут: второй сразу получит 409.
 
-@app.post("/data")
+@app.post("/data", status_code=202)
 async def send_to_telegram(data: SimpleBooking):
     if not BOT_TOKEN or not GROUP_ID:
         raise HTTPException(500, "Bot token/chat id не заданы")
@@ -73,33 +150,77 @@ async def send_to_telegram(data: SimpleBooking):
         "parse_mode": "MarkdownV2",
     }
 
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+    try:
+        _, order_id = await reservations.reserve_and_enqueue(
+            data.day.isoformat(), data.time, "sendMessage", payload
+        )
+    except reservations.SlotUnavailable:
+        raise HTTPException(409, "This time slot is no longer available")
 
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url, json=payload)
-        jr = r.json()
+    return {"ok": True, "order_id": order_id}
 
-        if not jr.get("ok"):
-            raise HTTPException(502, f"Telegram error: {jr}")
 
-    return {"ok": True}
+@app.get("/outbox/stats")
+async def outbox_stats():
+    return await outbox.stats()
 
 
 # ============= TELEGRAM WEBHOOK ==================
 
+# Webhook отвечает сразу: проверяет апдейт, отсекает повторы по update_id и ставит
+# его в очередь. Скачивание фото и запись в БД делают воркеры (см. ingest.py).
+
 @app.post("/webhook")
 async def telegram_webhook(req: Request):
-    body = await req.json()
+    if WEBHOOK_SECRET and req.headers.get("x-telegram-bot-api-secret-token") != WEBHOOK_SECRET:
+        raise HTTPException(403, "Bad secret token")
+
+    try:
+        body = await req.json()
+    except ValueError:
+        raise HTTPException(400, "Invalid JSON")
+    if not isinstance(body, dict):
+        raise HTTPException(400, "Update must be an object")
+
+    if BOT_MODE == "webhook" and is_bot_update(body):
+        # нажатия кнопок и команды админ-бота — в PTB, а не в очередь карточек
+        await relay_bot_update(body)
+        return {"ok": True}
+
     message = body.get("message") or body.get("edited_message") or {}
     thread_id = message.get("message_thread_id")
     # чтобы проверить, не режет ли по thread_id — временно можно закомментить
     if thread_id != UPDATES_TOPIC_ID:
         print("Другой thread_id, игнор:", thread_id)
         return {"ok": True}
+
+    if message.get("media_group_id"):
+        # часть альбома: подпись есть только у одной из частей, поэтому без фильтра по тексту
+        result = await ingest.accept_album_part(body, message)
+    elif not (message.get("text") or message.get("caption") or "").strip():
+        return {"ok": True}
+    else:
+        result = await ingest.accept(body, message)
+    if result == ingest.BUSY:
+        # очередь полна — Telegram повторит доставку позже
+        raise HTTPException(503, "Update queue is full")
+    return {"ok": True}
+
+
+@app.get("/webhook/stats")
+async def webhook_stats():
+    return ingest.stats()
+
+
+@app.get("/media_gc/stats")
+async def media_gc_stats():
+    return media_gc.stats()
+
+
+async def process_update(message: dict):
+    """Обработка одного сообщения из топика обновлений (в воркере ingest)"""
     text = (message.get("text") or message.get("caption") or "").strip()
     photo = message.get("photo")
-    if not text:
-        return {"ok": True}
 
     if text.startswith("/add"):
         print("Обрабатываем /add")
@@ -112,7 +233,6 @@ async def telegram_webhook(req: Request):
     elif text.startswith("/book"):
         print("Обрабатываем /book")
         await book_date(text)
-    return {"ok": True}
 
 
 
@@ -124,211 +244,553 @@ def message_parcing(text: str):  # или message_parsing – главное, ч
     return name, description
 
 
-async def save_message(text: str, photo):
-    # 1. парсим текст
+# скачивания фото (getFile + файл) из всех /add и альбомов идут не больше чем по N сразу
+PHOTO_DOWNLOADS = int(os.getenv("PHOTO_DOWNLOADS", 4))
+_download_slots = asyncio.Semaphore(PHOTO_DOWNLOADS)
+
+
+async def fetch_photo(photo) -> tuple[str | None, list]:
+    """Скачиваем самое большое фото и режем превью: (путь, варианты)"""
+    if not photo:
+        return None, []
+
     try:
-        title, desc = message_parcing(text)
+        async with _download_slots:
+            photo_path = await get_photo_file(photo[-1]["file_id"])  # самое большое фото
     except Exception as e:
-        print("Ошибка парсинга /add:", e, "текст:", repr(text))
-        return
+        print("Ошибка получения фото:", e)
+        return None, []
 
-    # 2. пробуем скачать фото (если есть)
-    photo_path = None
-    if photo:
+    # режем превью в пуле процессов (CPU не трогает event loop)
+    variants = []
+    if photo_path:
         try:
-            photo_id = photo[-1]["file_id"]  # самое большое фото
-            photo_path = await get_photo_file(photo_id)
+            variants = await images.make_variants(photo_path)
         except Exception as e:
-            print("Ошибка получения фото:", e)
-            photo_path = None
+            print("Ошибка обработки фото:", e)
+    return photo_path, variants
 
-    # 3. сохраняем запись в БД (async)
-    try:
-        async with aiosqlite.connect("data/art-updates.db") as db:
-            # на всякий случай создаём таблицу, если её ещё нет
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS photos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    photo_url TEXT
-                )
-            """)
 
-            await db.execute(
+async def insert_cards(new_cards: list[tuple[str, str, str | None, list]]):
+    """Карточки (название, описание, путь, превью) и их превью — одной транзакцией"""
+    async with db.write(db.ART) as conn:
+        for title, desc, photo_path, variants in new_cards:
+            cur = await conn.execute(
                 "INSERT INTO photos (title, description, photo_url) VALUES (?, ?, ?)",
                 (title, desc, photo_path)
             )
-            await db.commit()
+            photo_id = cur.lastrowid
+            await cur.close()
+            await conn.executemany(
+                "INSERT OR REPLACE INTO photo_variants (photo_id, format, width, height, url) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(photo_id, v["format"], v["width"], v["height"], v["url"]) for v in variants]
+            )
+
+
+async def save_message(text: str, photo):
+    # 1. парсим текст
+    try:
+        title, desc = message_parcing(text)
+    except Exception as e:
+        print("Ошибка парсинга /add:", e, "текст:", repr(text))
+        return
+
+    # 2. скачиваем фото (если есть) и режем превью
+    photo_path, variants = await fetch_photo(photo)
+
+    # 3. сохраняем запись и её превью в БД одной транзакцией
+    try:
+        await insert_cards([(title, desc, photo_path, variants)])
         print("Запись сохранена:", title, photo_path)
     except Exception as e:
         print("Ошибка записи в БД (photos):", e)
 
 
+async def process_album(messages: list[dict]):
+    """Альбом из топика обновлений: каждое фото — отдельная карточка.
+
+    Подпись /add у части альбома — название и описание этой карточки; части без
+    своей подписи берут подпись альбома. Фото качаются параллельно (в пределах
+    PHOTO_DOWNLOADS), карточки пишутся одной транзакцией.
+    """
+    captions = [(m.get("caption") or m.get("text") or "").strip() for m in messages]
+    album_caption = next((c for c in captions if c), "")
+    if not album_caption.startswith("/add"):
+        print("Альбом без /add, игнор:", repr(album_caption))
+        return
+
+    parts = []
+    for message, caption in zip(messages, captions):
+        if not message.get("photo"):
+            continue  # видео и документы в альбоме карточками не становятся
+        title, desc = message_parcing(caption if caption.startswith("/add") else album_caption)
+        parts.append((title, desc, message["photo"]))
+
+    fetched = await asyncio.gather(*(fetch_photo(photo) for _, _, photo in parts))
+
+    try:
+        await insert_cards([
+            (title, desc, photo_path, variants)
+            for (title, desc, _), (photo_path, variants) in zip(parts, fetched)
+        ])
+        print(f"Альбом сохранён: {len(parts)} карточек")
+    except Exception as e:
+        print("Ошибка записи альбома в БД (photos):", e)
+
+
 async def get_photo_file(photo_id: str) -> str | None:
     if not BOT_TOKEN:
         print("BOT_TOKEN не задан")
         return None
 
-    async with httpx.AsyncClient() as client:
-        r = await client.get(
-            f"https://api.telegram.org/bot{BOT_TOKEN}/getFile",
-            params={"file_id": photo_id}
-        )
-        r.raise_for_status()
-        data = r.json()
+    r = await tg_client.get_client().get(
+        tg_client.method_url("getFile"),
+        params={"file_id": photo_id}
+    )
+    r.raise_for_status()
+    data = r.json()
 
-        if not data.get("ok"):
-            print("Telegram getFile error:", data)
-            return None
+    if not data.get("ok"):
+        print("Telegram getFile error:", data)
+        return None
 
-        file_path = data["result"]["file_path"]
-        url = f"https://api.telegram.org/file/bot{BOT_TOKEN}/{file_path}"
+    file_path = data["result"]["file_path"]
+    url = tg_client.file_url(file_path)
 
-    return await download_file(url, folder="src")
+    return await download_file(url, folder=media.MEDIA_DIR)
 
 
-async def download_file(url: str, folder: str = "src") -> str | None:
-    os.makedirs(folder, exist_ok=True)
+MAX_PHOTO_BYTES = int(os.getenv("MAX_PHOTO_BYTES", 20 * 1024 * 1024))
+DOWNLOAD_CHUNK = 64 * 1024
 
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url)
-        r.raise_for_status()
-        content = r.content
 
-    file_name = url.split("/")[-1] or "image.jpg"
-    path = os.path.join(folder, file_name)
+async def download_file(url: str, folder: str = media.MEDIA_DIR) -> str | None:
+    """Качаем файл потоком во временный файл и кладём под именем sha256 содержимого.
 
-    # запись файла выносим в отдельную функцию, чтобы красиво передать в to_thread
-    def _write_file(p: str, data: bytes):
-        with open(p, "wb") as f:
-            f.write(data)
+    Память не зависит от размера картинки, одинаковые фото хранятся один раз.
+    """
+    os.makedirs(folder, exist_ok=True)
+    ext = os.path.splitext(url.split("/")[-1])[1].lower() or ".jpg"
 
-    await anyio.to_thread.run_sync(_write_file, path, content)
-    return path
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix=".download-", suffix=".part")
+    f = os.fdopen(fd, "wb")
+    try:
+        async with tg_client.get_client().stream("GET", url) as r:
+            r.raise_for_status()
+            if int(r.headers.get("content-length") or 0) > MAX_PHOTO_BYTES:
+                raise ValueError(f"Файл больше {MAX_PHOTO_BYTES} байт")
+
+            async for chunk in r.aiter_bytes(DOWNLOAD_CHUNK):
+                size += len(chunk)
+                if size > MAX_PHOTO_BYTES:
+                    raise ValueError(f"Файл больше {MAX_PHOTO_BYTES} байт")
+                digest.update(chunk)
+                await anyio.to_thread.run_sync(f.write, chunk)
+
+        await anyio.to_thread.run_sync(f.close)
+
+        path = os.path.join(folder, digest.hexdigest()[:32] + ext)
+
+        def _publish():
+            try:
+                # такое фото уже есть — дубликат не храним; свежий mtime, чтобы
+                # media_gc не убрал файл, пока пишется карточка
+                os.utime(path)
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                os.replace(tmp_path, path)  # атомарно: файл либо целый, либо его нет
+
+        await anyio.to_thread.run_sync(_publish)
+        return path
+    except BaseException:
+        f.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 # ============= GET CARD INFO ===================
+CARDS_CACHE_CONTROL = "public, no-cache"
+
+
 @app.get("/get_card_info")
-async def get_c():
-    async with aiosqlite.connect("data/art-updates.db") as db:
-        cursor = await db.execute(
-            "SELECT id, title, description, photo_url FROM photos"
-        )
-        rows = await cursor.fetchall()
-        await cursor.close()
+async def get_c(
+    request: Request,
+    after: int = Query(0, ge=0, description="курсор: id последней полученной карточки"),
+    limit: int = Query(cards.DEFAULT_PAGE_SIZE, ge=1, le=cards.MAX_PAGE_SIZE),
+    fields: Optional[str] = Query(None, description="например: title,photo_url"),
+):
+    try:
+        columns = cards.parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    # версию читаем ДО строк: в худшем случае ETag окажется старше данных,
+    # и клиент лишний раз перекачает страницу, но не застрянет на устаревшей
+    version = await cards.photos_version()
+    etag = make_etag(f"{version}:{after}:{limit}:{','.join(columns)}".encode())
+    headers = {"ETag": etag, "Cache-Control": CARDS_CACHE_CONTROL}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    async def body():
+        # JSON пишем по мере чтения строк, без сборки всего списка в памяти
+        yield b'{"Articles":['
+        count = 0
+        last_id = None
+        # aclosing: после break читатель сразу возвращается в пул, а не когда
+        # до генератора доберётся финализатор event loop
+        async with aclosing(cards.iter_page(after, limit, columns)) as items:
+            async for item in items:
+                if count == limit:
+                    # лишняя (limit + 1)-я строка — значит, есть следующая страница
+                    break
+                yield (b"," if count else b"") + json.dumps(item, ensure_ascii=False).encode()
+                count += 1
+                last_id = item["id"]
+            else:
+                last_id = None
+        yield b'],"next_cursor":' + json.dumps(last_id).encode() + b"}"
+
+    return StreamingResponse(body(), media_type="application/json", headers=headers)
+
+
+@app.get("/search_cards")
+async def search_cards(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(cards.DEFAULT_SEARCH_LIMIT, ge=1, le=cards.MAX_SEARCH_LIMIT),
+    fields: Optional[str] = Query(None, description="например: title,photo_url"),
+):
+    try:
+        columns = cards.parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    version = await cards.photos_version()
+    etag = make_etag(f"search:{version}:{q}:{limit}:{','.join(columns)}".encode())
+    headers = {"ETag": etag, "Cache-Control": CARDS_CACHE_CONTROL}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    found = await cards.search(q, limit, columns)
+    return Response(
+        content=json.dumps({"Articles": found}, ensure_ascii=False).encode(),
+        media_type="application/json",
+        headers=headers,
+    )
 
-    articles = [
-        {
-            "id": row[0],
-            "title": row[1],
-            "description": row[2],
-            "photo_url": row[3],
-        }
-        for row in rows
-    ]
+# ============= MEDIA (ЗАГРУЖЕННЫЕ КАРТИНКИ) ===================
 
-    return {"Articles": articles}
+@app.api_route("/media/{name}", methods=["GET", "HEAD"])
+async def get_media(name: str, request: Request):
+    return await media.serve(name, request)
 
 # ============= REMOVE MESSAGE ===================
 
-async def remove_message(text: str):
-    title = text.strip()
+_REMOVE_BY_ID_RE = re.compile(r"#?\d+(?:[\s,]+#?\d+)*")
+
 
-    async with aiosqlite.connect("data/art-updates.db") as db:
-        cur = await db.execute("SELECT photo_url FROM photos WHERE title = ?", (title,))
-        rows = await cur.fetchall()
+async def reply_admin(text: str):
+    """Ответ админу в топик обновлений (через outbox, как и заказы)"""
+    await outbox.enqueue("sendMessage", {
+        "chat_id": GROUP_ID,
+        "message_thread_id": UPDATES_TOPIC_ID,
+        "text": text,
+    })
 
-        # удалить картинки
-        for (path,) in rows:
-            if path:
-                await anyio.to_thread.run_sync(lambda: os.remove(path))
 
-        await db.execute("DELETE FROM photos WHERE title = ?", (title,))
-        await db.commit()
+async def remove_message(text: str):
+    """/remove 12 15 — по id; /remove <название> — точное название или единственная находка поиска"""
+    query = text.removeprefix("/remove").strip()
+    if not query:
+        print("В /remove не указано, что удалять")
+        return False
+
+    if _REMOVE_BY_ID_RE.fullmatch(query):
+        ids = [int(x) for x in re.findall(r"\d+", query)]
+    else:
+        ids = await cards.ids_by_title(query)
+        if not ids:
+            found = await cards.search(query, 5, ("id", "title"))
+            if len(found) > 1:
+                variants = "\n".join(f"#{c['id']} {c['title']}" for c in found)
+                await reply_admin(f"Под «{query}» подходит несколько карточек:\n{variants}\nУдали нужную: /remove <id>")
+                return False
+            ids = [c["id"] for c in found]
+
+    if not ids:
+        await reply_admin(f"Карточка «{query}» не найдена")
+        return False
+
+    # мягкое удаление: карточка сразу пропадает из выдачи, а строку и файлы
+    # (если на них больше никто не ссылается) позже уберёт media_gc
+    marks = ",".join("?" * len(ids))
+    async with db.write(db.ART) as conn:
+        cur = await conn.execute(
+            f"UPDATE photos SET deleted_at = ? WHERE id IN ({marks}) AND deleted_at IS NULL",
+            (time.time(), *ids),
+        )
+        deleted = cur.rowcount
+        await cur.close()
 
-    return True
+    print(f"/remove {query!r}: удалено карточек {deleted}")
+    return deleted > 0
 
 
 # ============= BOOK DATES (FROM BOT) ===================
 
 async def book_date(text: str):
-    raw_date = text.split(" ", 1)[1].strip()
+    days = text.split()[1:]  # /book 2025-11-22 2025-11-23
+    if not days:
+        print("В /book не указаны даты:", repr(text))
+        return False
 
-    async with aiosqlite.connect("data/booking.db") as db:
-        await db.execute(
-            "INSERT INTO bookings (date) VALUES (?)",
-            (raw_date,)
-        )
-        await db.commit()
-    return True
+    booked, already = await reservations.book_days(days)
+    if already:
+        print("Эти даты уже заняты:", already)
+    return bool(booked)
 
 
-# ============= SAVE AVAILABLE DATES (FROM BOT) ========
+# ============= SAVE AVAILABLE DATES ========
+# Бот пишет напрямую через availability.save; эндпоинт оставлен для внешних клиентов.
 
 @app.post("/your_available_dates")
-async def save_available_dates(req: Request):
-    data = await req.json()
-    dates_times: Dict[str, List[str]] = data.get("dates_times", {})
-
-    async with aiosqlite.connect("data/booking.db") as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS avalible_dates (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                date TEXT NOT NULL,
-                time TEXT NOT NULL,
-                UNIQUE(date, time)
-            )
-        """)
+async def save_available_dates(data: AvailableDates):
+    dates_times = {d.isoformat(): times for d, times in data.dates_times.items()}
 
-        for d, times in dates_times.items():
-            for t in times:
-                await db.execute(
-                    "INSERT OR IGNORE INTO avalible_dates(date, time) VALUES (?, ?)",
-                    (d, t)
-                )
+    summary = await availability.save(dates_times, replace=data.replace)
 
-        await db.commit()
+    return {"ok": True, **summary}
 
-    return {"ok": True}
+
+@app.post("/your_available_dates/template")
+async def save_available_dates_template(template: AvailabilityTemplate):
+    """Повторяющееся расписание (пн–пт 10–18 на N недель) — одной транзакцией"""
+    try:
+        summary = await recurring.apply(**template.model_dump())
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+    return {"ok": True, **summary}
 
 
 # ============= GET AVAILABLE (TO FRONTEND) ============
 
+BOOKINGS_CACHE_CONTROL = "public, no-cache"  # браузер хранит ответ, но каждый раз ревалидирует по ETag
+
+
 @app.get("/bookings")
-async def get_bookings():
-    async with aiosqlite.connect("data/booking.db") as db:
-        cur = await db.execute("SELECT date, time FROM avalible_dates")
-        rows = await cur.fetchall()
+async def get_bookings(
+    request: Request,
+    date_from: Optional[date] = Query(None, alias="from", description="по умолчанию — сегодня"),
+    date_to: Optional[date] = Query(None, alias="to", description="включительно; по умолчанию — без конца"),
+):
+    if date_from is not None and date_to is not None and date_to < date_from:
+        raise HTTPException(400, "'to' must not be earlier than 'from'")
+
+    date_range = None
+    if date_from is not None or date_to is not None:
+        default_from, _ = availability.default_range()
+        date_range = (
+            date_from.isoformat() if date_from else default_from,
+            date_to.isoformat() if date_to else None,
+        )
+
+    body, etag = await availability.snapshot(date_range)
+    headers = {"ETag": etag, "Cache-Control": BOOKINGS_CACHE_CONTROL}
 
-    dates_times: Dict[str, List[str]] = {}
-    for d, t in rows:
-        dates_times.setdefault(d, []).append(t)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
 
-    return {"dates_times": dates_times}
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+# ============= PUSH AVAILABLE (SSE) ============
+# Вместо опроса раз в 20 секунд: при подключении — snapshot (то же, что /bookings),
+# дальше — дельты {"added": {...}, "removed": {...}} и heartbeat-комментарии.
+# При переподключении браузер шлёт Last-Event-ID и получает только пропущенное.
+
+@app.get("/bookings/stream")
+async def bookings_stream(request: Request):
+    hub = events.availability_hub
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+
+    async def snapshot_event() -> bytes:
+        event_id = hub.last_id
+        body, _ = await availability.snapshot()
+        return events.format_event("snapshot", body, event_id)
+
+    async def stream():
+        # подписываемся до snapshot, чтобы не потерять изменения между ними
+        queue = hub.subscribe()
+        try:
+            yield f"retry: {events.RETRY_MS}\n\n".encode()
+            replay = hub.replay_since(last_event_id)
+            if replay is None:
+                yield await snapshot_event()
+            else:
+                for message in replay:
+                    yield message
+
+            deadline = asyncio.get_running_loop().time() + events.stream_lifetime()
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                try:
+                    message = await asyncio.wait_for(queue.get(), max(0.0, remaining))
+                except asyncio.TimeoutError:
+                    return  # клиент переподключится с Last-Event-ID
+                if message is None:  # сервер останавливается
+                    return
+                if message is events.RESYNC:
+                    message = await snapshot_event()
+                yield message
+        finally:
+            hub.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ============= METRICS (PROMETHEUS) ============
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 
 # ============= START SERVER + BOT =========================
+# Воркеров может быть несколько:
+#   BOT_MODE=webhook uvicorn main:app --workers 4
+# API обслуживают все, а бот, outbox и чистку БД запускает только лидер (leader.py);
+# если лидер умрёт, их подхватит другой воркер.
+# В режиме webhook бот стартует без Updater: апдейты приходят на /webhook и
+# кладутся прямо в application.update_queue (с другого воркера — через bot_inbox).
+# BOT_MODE=polling оставлен как запасной вариант (например, без публичного адреса).
+
+BOT_COMMANDS = ("add_dates", "template")
+BOT_ALLOWED_UPDATES = ["message", "edited_message", "callback_query"]
+
+_bot_application = None
+
+
+def is_bot_update(body: dict) -> bool:
+    """Апдейт для админ-бота: нажатие кнопки или одна из BOT_COMMANDS"""
+    if "callback_query" in body:
+        return True
+    text = ((body.get("message") or {}).get("text") or "").strip()
+    if not text.startswith("/"):
+        return False
+    command = text.split(maxsplit=1)[0][1:].split("@", 1)[0]
+    return command in BOT_COMMANDS
+
 
+async def deliver_bot_update(body: dict):
+    from telegram import Update
 
+    application = _bot_application
+    if application is None:
+        raise RuntimeError("бот не запущен")
+    await application.update_queue.put(Update.de_json(body, application.bot))
 
 
+async def relay_bot_update(body: dict):
+    if _bot_application is not None:
+        await deliver_bot_update(body)
+    elif not leader.is_leader():
+        await bot_inbox.put(body)  # бот у лидера в другом воркере
+    else:
+        # лидер — мы, а бот не запустился: bot_inbox разбирать некому, апдейт бы там застрял
+        print("Бот не запущен, апдейт пропущен:", body.get("update_id"))
 
-def start_telegram_bot():
+
+async def start_telegram_bot():
+    """Админ-бот в event loop приложения: общий пул БД, без отдельного потока"""
+    global _bot_application
     from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler
+    import data.booking as booking_bot
+    from data.persistence import SQLitePersistence
+
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN не задан в .env")
 
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
-
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .base_url(f"{tg_client.api_base()}/bot")
+        .base_file_url(f"{tg_client.api_base()}/file/bot")
+        .persistence(SQLitePersistence())  # незаконченный мастер переживает рестарт
+    )
+    if BOT_MODE == "webhook":
+        builder = builder.updater(None)
+    application = builder.build()
     application.add_handler(CommandHandler("add_dates", booking_bot.start))
+    application.add_handler(CommandHandler("template", booking_bot.template))
     application.add_handler(CallbackQueryHandler(booking_bot.handle_callbacks))
-    application.run_polling()
+
+    # запоминаем сразу: если запуск прервут (лидерство потеряно) или он упадёт,
+    # stop_telegram_bot остановит то, что успело подняться
+    _bot_application = application
+    await application.initialize()
+    await application.start()
+
+    if BOT_MODE == "webhook":
+        await bot_inbox.start(deliver_bot_update)
+        if WEBHOOK_URL:
+            try:
+                await application.bot.set_webhook(
+                    WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=BOT_ALLOWED_UPDATES
+                )
+            except Exception as e:
+                # вебхук мог быть выставлен вручную — бот всё равно принимает апдейты
+                print("Не удалось вызвать setWebhook:", repr(e))
+    else:
+        await application.updater.start_polling(allowed_updates=BOT_ALLOWED_UPDATES)
+
+
+async def stop_telegram_bot():
+    global _bot_application
+    application, _bot_application = _bot_application, None
+    if application is None:
+        return
+    await bot_inbox.stop()
+    if application.updater is not None and application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    await application.shutdown()
+
+
+async def start_leader_jobs():
+    await outbox.start()
+    await compaction.start()
+    await media_gc.start()
+    if BOT_MODE in ("polling", "webhook"):
+        try:
+            await start_telegram_bot()
+        except Exception as e:
+            # без бота заказы всё равно должны уходить — outbox оставляем работать
+            print("Не удалось запустить бота:", repr(e))
+            await stop_telegram_bot()
+
+
+async def stop_leader_jobs():
+    await stop_telegram_bot()
+    await media_gc.stop()
+    await compaction.stop()
+    await outbox.stop()
 
 
 if __name__ == "__main__":
-    import threading
     import uvicorn
-    import data.booking as booking_bot
-    bot_thread = threading.Thread(target=start_telegram_bot, daemon=True)
-    bot_thread.start()
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False) #FastAPI-сервер в главном потоке
+    os.environ.setdefault("BOT_MODE", "polling")  # как раньше: python main.py поднимает и бота
+    # не ждём бесконечно долгие соединения при остановке — lifespan (отпустить аренду
+    # лидера, дописать состояние бота и outbox) должен отработать
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False, timeout_graceful_shutdown=10)
@@ -0,0 +1,90 @@
+import mimetypes
+import os
+import re
+from typing import Optional
+
+import anyio
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+
+from http_cache import etag_matches
+
+
+# ============= РАЗДАЧА ЗАГРУЖЕННЫХ КАРТИНОК (/media) =============
+# Файлы с именем-хэшем (см. download_file и images.py) никогда не меняются,
+# поэтому их можно кэшировать навсегда: Cache-Control immutable + сильный ETag.
+# Range / If-Range и zero-copy (ASGI pathsend, если сервер его поддерживает)
+# даёт FileResponse из Starlette.
+
+MEDIA_DIR = os.getenv("MEDIA_DIR", "src")
+
+# <sha256[:32]>.jpg или <sha256[:32]>-640w.webp
+HASHED_NAME_RE = re.compile(r"^(?P<hash>[0-9a-f]{32})(?:-(?P<width>\d+)w)?\.[a-z0-9]+$")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+MUTABLE_CACHE_CONTROL = "public, no-cache"
+
+# предсжатые копии рядом с файлом: logo.svg.br, logo.svg.gz
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+
+def media_path(name: str) -> Optional[str]:
+    """Имя из URL -> путь на диске; всё, что похоже на обход каталогов, отбрасываем"""
+    if not name or name != os.path.basename(name) or name.startswith(".") or "\\" in name:
+        return None
+    return os.path.join(MEDIA_DIR, name)
+
+
+def _accepts(request: Request, coding: str) -> bool:
+    header = request.headers.get("accept-encoding", "")
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        if token.strip().lower() == coding:
+            return params.replace(" ", "") not in ("q=0", "q=0.0")
+    return False
+
+
+def _stat(path: str) -> Optional[os.stat_result]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st if os.path.isfile(path) else None
+
+
+async def serve(name: str, request: Request) -> Response:
+    path = media_path(name)
+    stat_result = await anyio.to_thread.run_sync(_stat, path) if path else None
+    if stat_result is None:
+        return Response(status_code=404)
+
+    hashed = HASHED_NAME_RE.match(name)
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+    if hashed:
+        # имя и есть хэш содержимого — ETag не зависит от mtime и одинаков на всех серверах
+        etag = f'"{name}"'
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    else:
+        etag = f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+        cache_control = MUTABLE_CACHE_CONTROL
+
+    headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+    # отдаём предсжатый вариант, если он есть и клиент его принимает
+    for coding, suffix in PRECOMPRESSED:
+        if not _accepts(request, coding):
+            continue
+        encoded_stat = await anyio.to_thread.run_sync(_stat, path + suffix)
+        if encoded_stat is not None:
+            path, stat_result = path + suffix, encoded_stat
+            etag = etag[:-1] + f'-{coding}"'
+            headers["Content-Encoding"] = coding
+            break
+
+    headers["ETag"] = etag
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    return FileResponse(path, headers=headers, media_type=media_type, stat_result=stat_result)
@@ -0,0 +1,180 @@
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+import anyio
+
+import db
+import media
+import metrics
+
+
+# ============= СБОРКА МУСОРА В MEDIA_DIR =============
+# /remove только ставит карточке метку deleted_at (мягкое удаление). Задача лидера
+# раз в MEDIA_GC_INTERVAL:
+#   1. окончательно удаляет карточки, помеченные раньше, чем TOMBSTONE_TTL назад
+#      (превью уходят каскадом);
+#   2. сверяет MEDIA_DIR с базой и удаляет файлы-хэши (и их .br/.gz), на которые
+#      не ссылается ни одна строка, плюс брошенные .part от упавших загрузок.
+# Файлы моложе MEDIA_GC_GRACE не трогаем: их могли только что скачать, а карточку
+# ещё не записали. Удаление идёт пачками в одном рабочем потоке.
+
+INTERVAL = float(os.getenv("MEDIA_GC_INTERVAL", 3600))
+GRACE = float(os.getenv("MEDIA_GC_GRACE", 3600))
+TOMBSTONE_TTL = float(os.getenv("TOMBSTONE_TTL", 86400))
+BATCH_SIZE = int(os.getenv("MEDIA_GC_BATCH", 500))
+
+reclaimed_bytes = metrics.Counter(
+    "media_gc_reclaimed_bytes_total", "Освобождено байт удалением ненужных файлов в MEDIA_DIR"
+)
+removed_files = metrics.Counter("media_gc_removed_files_total", "Удалено ненужных файлов в MEDIA_DIR")
+
+_task: Optional[asyncio.Task] = None
+_last: Dict[str, object] = {}
+_totals = {"removed_files": 0, "reclaimed_bytes": 0}
+
+
+async def _purge_tombstones(now: float) -> int:
+    """Окончательно удаляем карточки, помеченные раньше now - TOMBSTONE_TTL"""
+    purged = 0
+    while True:
+        async with db.write(db.ART) as conn:
+            cur = await conn.execute(
+                "DELETE FROM photos WHERE id IN ("
+                "SELECT id FROM photos WHERE deleted_at < ? LIMIT ?)",
+                (now - TOMBSTONE_TTL, BATCH_SIZE),
+            )
+            count = cur.rowcount
+            await cur.close()
+        purged += count
+        if count < BATCH_SIZE:
+            return purged
+        await asyncio.sleep(0)
+
+
+async def _referenced() -> Set[str]:
+    """Имена файлов, на которые ссылается хоть одна строка (и помеченные тоже)"""
+    async with db.read(db.ART) as conn:
+        cur = await conn.execute(
+            "SELECT photo_url FROM photos WHERE photo_url IS NOT NULL "
+            "UNION SELECT url FROM photo_variants"
+        )
+        names = {os.path.basename(url) for (url,) in await cur.fetchall() if url}
+        await cur.close()
+    return names
+
+
+def _candidates(referenced: Set[str], older_than: float) -> List[str]:
+    """Пути в MEDIA_DIR, которые можно удалить (выполняется в потоке)"""
+    found = []
+    try:
+        entries = os.scandir(media.MEDIA_DIR)
+    except FileNotFoundError:
+        return found
+
+    with entries:
+        for entry in entries:
+            name = entry.name
+            if name.endswith(".part"):
+                pass  # недокачанный/недорезанный файл
+            else:
+                base = name
+                for _, suffix in media.PRECOMPRESSED:
+                    if base.endswith(suffix):
+                        base = base[: -len(suffix)]
+                        break
+                # без хэша в имени — статика проекта, её не трогаем
+                if not media.HASHED_NAME_RE.match(base) or base in referenced:
+                    continue
+            try:
+                if entry.is_file(follow_symlinks=False) and entry.stat().st_mtime < older_than:
+                    found.append(entry.path)
+            except FileNotFoundError:
+                pass
+    return found
+
+
+def _remove(paths: List[str], older_than: float) -> Tuple[int, int]:
+    """Удаляем пачку файлов (в потоке), возвращаем (файлов, байт)"""
+    files = size = 0
+    for path in paths:
+        try:
+            st = os.stat(path)
+            if st.st_mtime >= older_than:
+                continue  # файл успели переиспользовать после сверки
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        files += 1
+        size += st.st_size
+    return files, size
+
+
+async def run_once(now: Optional[float] = None) -> Dict[str, int]:
+    now = now or time.time()
+    started = time.monotonic()
+
+    purged = await _purge_tombstones(now)
+    referenced = await _referenced()
+    older_than = now - GRACE
+
+    def _sweep() -> Tuple[int, int]:
+        # один поток на весь проход, а не по потоку на файл
+        paths = _candidates(referenced, older_than)
+        files = size = 0
+        for i in range(0, len(paths), BATCH_SIZE):
+            batch_files, batch_size = _remove(paths[i:i + BATCH_SIZE], older_than)
+            files += batch_files
+            size += batch_size
+        return files, size
+
+    files, size = await anyio.to_thread.run_sync(_sweep)
+    reclaimed_db = await db.vacuum(db.ART) if purged else 0
+
+    removed_files.inc(amount=files)
+    reclaimed_bytes.inc(amount=size)
+    _totals["removed_files"] += files
+    _totals["reclaimed_bytes"] += size
+    result = {
+        "purged_cards": purged,
+        "removed_files": files,
+        "reclaimed_bytes": size,
+        "reclaimed_db_bytes": reclaimed_db,
+    }
+    _last.update(result, finished_at=now, duration=round(time.monotonic() - started, 3))
+    if purged or files:
+        print(f"[media_gc] удалено карточек: {purged}, файлов: {files}, освобождено {size} байт")
+    return result
+
+
+def stats() -> Dict[str, object]:
+    """Итоги последнего прохода и суммарно с запуска процесса"""
+    return {
+        "last_run": dict(_last),
+        "total_removed_files": _totals["removed_files"],
+        "total_reclaimed_bytes": _totals["reclaimed_bytes"],
+    }
+
+
+async def _run():
+    while True:
+        try:
+            await run_once()
+        except Exception as e:
+            print("[media_gc] ошибка:", repr(e))
+        await asyncio.sleep(INTERVAL)
+
+
+async def start() -> None:
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
@@ -0,0 +1,325 @@
+import asyncio
+import bisect
+import os
+import re
+import threading
+import time
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+
+# ============= МЕТРИКИ (ТЕКСТОВЫЙ ФОРМАТ PROMETHEUS) =============
+# Без внешних зависимостей: счётчик, gauge и гистограмма — это словари
+# {значения меток: число}, обновление — одна блокировка и пара сложений,
+# поэтому метрики можно держать включёнными под нагрузкой. Текст для /metrics
+# собирается только при опросе. Всё, включая бота, работает в event loop;
+# блокировка — чтобы метрики можно было обновлять и из рабочих потоков
+# (anyio.to_thread), в самом loop она никогда не конкурирует.
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# секунды: от быстрых запросов в SQLite до долгих ответов Telegram
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LOOP_LAG_INTERVAL = float(os.getenv("METRICS_LOOP_LAG_INTERVAL", 0.5))
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._callback = callback  # значение считается в момент опроса (глубина очереди и т.п.)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def _samples(self) -> List[str]:
+        if self._callback is not None:
+            try:
+                return [f"{self.name} {_format_value(self._callback())}"]
+            except Exception as e:
+                print(f"[metrics] {self.name}: {e!r}")
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # значения меток -> [счётчики по корзинам (+Inf последней), сумма]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(counts), total) for k, (counts, total) in self._values.items()]
+
+        lines = []
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound) if bound != float("inf") else "+Inf"}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+def render() -> bytes:
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return ("\n".join(lines) + "\n").encode()
+
+
+# ============= МЕТРИКИ ПРИЛОЖЕНИЯ =============
+
+http_requests = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route", "status"))
+db_queries = Histogram(
+    "sqlite_query_duration_seconds", "Время выполнения запроса SQLite", ("db", "operation", "table"))
+db_write_lock_wait = Histogram(
+    "sqlite_write_lock_wait_seconds", "Ожидание единственного пишущего соединения", ("db",))
+telegram_requests = Histogram(
+    "telegram_request_duration_seconds", "Время ответа Telegram Bot API", ("method", "status"))
+telegram_errors = Counter(
+    "telegram_errors_total", "Ошибки Telegram Bot API: HTTP-статус >= 400 или сбой соединения", ("method", "reason"))
+telegram_rate_limited = Counter(
+    "telegram_rate_limited_total", "Ответы 429 / RetryAfter от Telegram", ("source",))
+edit_queue_wait = Histogram(
+    "telegram_edit_queue_wait_seconds", "Сколько правка ждала в очереди планировщика до отправки")
+loop_lag = Histogram(
+    "event_loop_lag_seconds", "Насколько позже положенного просыпается таймер event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+loop_lag_last = Gauge("event_loop_lag_last_seconds", "Последнее измерение задержки event loop")
+
+
+# ============= HTTP: ЗАДЕРЖКА ПО МАРШРУТАМ =============
+
+class HTTPMetricsMiddleware:
+    """Чистый ASGI-middleware: ничего не буферизует, стримы (SSE) проходят как есть.
+
+    Метка route — шаблон маршрута (/media/{name}), а не сам путь, чтобы
+    число рядов не росло с каждым новым файлом. SSE-ответы не учитываются:
+    их «длительность» — это время жизни подписки.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = {"code": 500, "stream": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                for key, value in message.get("headers", ()):
+                    if key == b"content-type" and value.startswith(b"text/event-stream"):
+                        status["stream"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not status["stream"]:
+                route = scope.get("route")
+                http_requests.observe(
+                    time.perf_counter() - started,
+                    scope["method"],
+                    getattr(route, "path", "unmatched"),
+                    str(status["code"]),
+                )
+
+
+# ============= SQLITE: ВРЕМЯ ЗАПРОСОВ =============
+
+_SQL_RE = re.compile(
+    r"^.*?\b(?:FROM|INTO|TABLE(?:\s+IF\s+(?:NOT\s+)?EXISTS)?)\s+(?P<table>\w+)",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+@lru_cache(maxsize=512)
+def sql_labels(sql: str) -> Tuple[str, str]:
+    """(операция, таблица) для SQL; запросы в коде — константы, так что кэш маленький"""
+    words = sql.split(None, 2)
+    if not words:
+        return "?", "-"
+    op = words[0].upper()
+    if op == "UPDATE" and len(words) > 1:
+        # в UPDATE таблица идёт сразу после ключевого слова
+        return op, words[1]
+    match = _SQL_RE.match(sql)
+    return op, (match.group("table") if match else "-")
+
+
+class TimedConnection:
+    """Обёртка над aiosqlite.Connection: засекает execute/executemany, остальное — как есть"""
+
+    __slots__ = ("_conn", "_db")
+
+    def __init__(self, conn, db_name: str):
+        self._conn = conn
+        self._db = db_name
+
+    async def execute(self, sql: str, parameters=None):
+        started = time.perf_counter()
+        try:
+            return await self._conn.execute(sql, parameters)
+        finally:
+            db_queries.observe(time.perf_counter() - started, self._db, *sql_labels(sql))
+
+    async def executemany(self, sql: str, parameters):
+        started = time.perf_counter()
+        try:
+            return await self._conn.executemany(sql, parameters)
+        finally:
+            db_queries.observe(time.perf_counter() - started, self._db, *sql_labels(sql))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+# ============= TELEGRAM: ВРЕМЯ ОТВЕТА И 429 =============
+
+def telegram_method(path: str) -> str:
+    """/bot<token>/sendMessage -> sendMessage; /file/bot<token>/... -> file (токен в метки не попадает)"""
+    if path.startswith("/file/"):
+        return "file"
+    return path.rsplit("/", 1)[-1] or "?"
+
+
+class TelegramMetricsTransport(httpx.AsyncBaseTransport):
+    """Транспорт-обёртка для общего клиента Telegram: время до заголовков ответа, ошибки, 429"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        method = telegram_method(request.url.path)
+        started = time.perf_counter()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except httpx.TransportError as e:
+            telegram_requests.observe(time.perf_counter() - started, method, "error")
+            telegram_errors.inc(method, type(e).__name__)
+            raise
+
+        telegram_requests.observe(time.perf_counter() - started, method, str(response.status_code))
+        if response.status_code >= 400:
+            telegram_errors.inc(method, str(response.status_code))
+            if response.status_code == 429:
+                telegram_rate_limited.inc("api")
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+# ============= ЗАДЕРЖКА EVENT LOOP =============
+# Таймер просит разбудить его через LOOP_LAG_INTERVAL; насколько позже он проснулся —
+# столько loop был занят чужим синхронным кодом (тяжёлый JSON, блокирующий вызов и т.п.).
+
+_lag_task: Optional[asyncio.Task] = None
+
+
+async def _measure_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(0.0, loop.time() - expected)
+        loop_lag.observe(lag)
+        loop_lag_last.set(lag)
+
+
+def start() -> None:
+    global _lag_task
+    if _lag_task is None:
+        _lag_task = asyncio.create_task(_measure_loop_lag())
+
+
+async def stop() -> None:
+    global _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        await asyncio.gather(_lag_task, return_exceptions=True)
+        _lag_task = None
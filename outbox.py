@@ -0,0 +1,257 @@
+import asyncio
+import json
+import os
+import random
+import time
+from typing import Dict, Optional, Set
+
+import httpx
+
+import db
+import tg_client
+
+
+# ============= OUTBOX: ДОСТАВКА СООБЩЕНИЙ В TELEGRAM В ФОНЕ =============
+# Заказ сначала пишется в таблицу outbox (booking.db), эндпоинт сразу отвечает 202,
+# а фоновый воркер разбирает очередь: ограничение параллельности, экспоненциальный
+# backoff и пауза на retry_after, если Telegram ответил 429.
+# Статусы: pending -> sending -> sent | failed.
+
+CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", 4))
+MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 10))
+BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", 2.0))
+BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", 600.0))
+# заказы, принятые другими воркерами, лидера не будят — он сам заглядывает в таблицу
+IDLE_POLL = float(os.getenv("OUTBOX_IDLE_POLL", 1.0))
+
+_task: Optional[asyncio.Task] = None
+_wake = asyncio.Event()
+_inflight: Set[asyncio.Task] = set()
+_paused_until = 0.0  # глобальная пауза после 429 — лимит у Telegram на бота, а не на сообщение
+
+
+async def enqueue(method: str, payload: dict, conn=None) -> int:
+    """Кладём вызов Bot API в outbox. conn — если нужно в чужой транзакции"""
+    now = time.time()
+    sql = (
+        "INSERT INTO outbox (method, payload, next_attempt_at, created_at) "
+        "VALUES (?, ?, ?, ?)"
+    )
+    params = (method, json.dumps(payload, ensure_ascii=False), now, now)
+
+    if conn is not None:
+        cur = await conn.execute(sql, params)
+    else:
+        async with db.write(db.BOOKING) as conn:
+            cur = await conn.execute(sql, params)
+    outbox_id = cur.lastrowid
+    await cur.close()
+
+    _wake.set()
+    return outbox_id
+
+
+async def stats() -> Dict[str, object]:
+    """Глубина очереди: количество по статусам и возраст самой старой неотправленной записи"""
+    async with db.read(db.BOOKING) as conn:
+        cur = await conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+        by_status = {status: count for status, count in await cur.fetchall()}
+        await cur.close()
+        cur = await conn.execute(
+            "SELECT MIN(created_at) FROM outbox WHERE status IN ('pending', 'sending')"
+        )
+        (oldest,) = await cur.fetchone()
+        await cur.close()
+
+    return {
+        "pending": by_status.get("pending", 0),
+        "sending": by_status.get("sending", 0),
+        "sent": by_status.get("sent", 0),
+        "failed": by_status.get("failed", 0),
+        "oldest_pending_age": round(time.time() - oldest, 3) if oldest else 0.0,
+        "paused_for": round(max(0.0, _paused_until - time.time()), 3),
+    }
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+    return delay * random.uniform(0.8, 1.2)
+
+
+async def _claim(limit: int) -> list:
+    now = time.time()
+    async with db.write(db.BOOKING) as conn:
+        cur = await conn.execute(
+            """
+            UPDATE outbox SET status = 'sending', attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM outbox
+                WHERE status = 'pending' AND next_attempt_at <= ?
+                ORDER BY id LIMIT ?
+            )
+            RETURNING id, method, payload, attempts
+            """,
+            (now, limit),
+        )
+        rows = await cur.fetchall()
+        await cur.close()
+    return rows
+
+
+async def _next_due() -> Optional[float]:
+    async with db.read(db.BOOKING) as conn:
+        cur = await conn.execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'"
+        )
+        (due,) = await cur.fetchone()
+        await cur.close()
+    return due
+
+
+async def _finish(outbox_id: int, status: str, error: Optional[str] = None, retry_in: float = 0.0):
+    now = time.time()
+    async with db.write(db.BOOKING) as conn:
+        if status == "sent":
+            await conn.execute(
+                "UPDATE outbox SET status = 'sent', sent_at = ?, last_error = NULL WHERE id = ?",
+                (now, outbox_id),
+            )
+        else:
+            await conn.execute(
+                "UPDATE outbox SET status = ?, last_error = ?, next_attempt_at = ? WHERE id = ?",
+                (status, error, now + retry_in, outbox_id),
+            )
+
+
+async def _attempt(outbox_id: int, method: str, payload: str, attempts: int):
+    global _paused_until
+
+    try:
+        jr = await tg_client.call(method, json.loads(payload))
+    except (httpx.HTTPError, ValueError) as e:
+        # сеть / таймаут / не-JSON ответ — пробуем позже
+        error = f"{type(e).__name__}: {e}"
+        jr = None
+    else:
+        error = None
+        if not isinstance(jr, dict):
+            error, jr = f"unexpected response: {jr!r:.200}", None
+
+    if jr is not None and jr.get("ok"):
+        await _finish(outbox_id, "sent")
+        return
+
+    if jr is not None:
+        error = f"{jr.get('error_code')}: {jr.get('description')}"
+        retry_after = (jr.get("parameters") or {}).get("retry_after")
+        if jr.get("error_code") == 429 and retry_after:
+            # Telegram сам сказал, сколько ждать — ставим паузу на всю очередь
+            _paused_until = max(_paused_until, time.time() + float(retry_after))
+            print(f"[outbox] 429, пауза {retry_after} сек")
+            await _finish(outbox_id, "pending", error, retry_in=float(retry_after))
+            return
+        if 400 <= (jr.get("error_code") or 0) < 500:
+            # остальные 4xx повтором не лечатся (битый текст, нет доступа к чату и т.п.)
+            print(f"[outbox] #{outbox_id} не доставлено: {error}")
+            await _finish(outbox_id, "failed", error)
+            return
+
+    if attempts >= MAX_ATTEMPTS:
+        print(f"[outbox] #{outbox_id} сдались после {attempts} попыток: {error}")
+        await _finish(outbox_id, "failed", error)
+    else:
+        await _finish(outbox_id, "pending", error, retry_in=_backoff(attempts))
+
+
+async def _deliver(outbox_id: int, method: str, payload: str, attempts: int):
+    try:
+        await _attempt(outbox_id, method, payload, attempts)
+        return
+    except Exception as e:
+        # что угодно ещё (например, БД занята при записи статуса) — запись не должна
+        # застрять в 'sending' до перезапуска: возвращаем её в очередь как обычный сбой
+        error = f"{type(e).__name__}: {e}"
+        print(f"[outbox] #{outbox_id} ошибка доставки:", error)
+
+    status = "failed" if attempts >= MAX_ATTEMPTS else "pending"
+    for delay in (0.0, 1.0, 5.0):
+        await asyncio.sleep(delay)
+        try:
+            await _finish(outbox_id, status, error, retry_in=_backoff(attempts))
+            return
+        except Exception as e:
+            print(f"[outbox] #{outbox_id} не удалось вернуть в очередь:", repr(e))
+
+
+def _on_done(task: asyncio.Task):
+    _inflight.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print("[outbox] ошибка доставки:", task.exception())
+    _wake.set()
+
+
+async def _run():
+    while True:
+        _wake.clear()
+        now = time.time()
+        free = CONCURRENCY - len(_inflight)
+        timeout: Optional[float] = IDLE_POLL
+
+        if now < _paused_until:
+            timeout = _paused_until - now
+        elif free > 0:
+            try:
+                rows = await _claim(free)
+            except Exception as e:
+                print("[outbox] ошибка чтения очереди:", e)
+                rows = []
+
+            for row in rows:
+                task = asyncio.create_task(_deliver(*row))
+                _inflight.add(task)
+                task.add_done_callback(_on_done)
+
+            if len(rows) == free:
+                continue  # возможно, в очереди есть ещё — ждём освобождения слота
+
+            try:
+                due = await _next_due()
+            except Exception as e:
+                # задача диспетчера не должна умирать молча — подождём и попробуем снова
+                print("[outbox] ошибка чтения очереди:", e)
+                due = None
+            if due is not None:
+                timeout = min(IDLE_POLL, max(0.0, due - time.time()))
+        else:
+            timeout = None  # все слоты заняты — ждём, пока какой-то освободится
+
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def start() -> None:
+    global _task
+
+    if _task is not None:
+        return
+
+    # то, что осталось в 'sending' после падения процесса, отправляем заново
+    async with db.write(db.BOOKING) as conn:
+        await conn.execute("UPDATE outbox SET status = 'pending' WHERE status = 'sending'")
+
+    _task = asyncio.create_task(_run())
+
+
+async def stop() -> None:
+    global _task
+
+    if _task is None:
+        return
+
+    _task.cancel()
+    for task in list(_inflight):
+        task.cancel()
+    await asyncio.gather(_task, *_inflight, return_exceptions=True)
+    _task = None
@@ -0,0 +1,161 @@
+import re
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+import availability
+
+
+# ============= ШАБЛОНЫ РАСПИСАНИЯ =============
+# Вместо сотни нажатий в календаре бота — одно правило:
+#   /template Mon-Fri 10:00-18:00 12w except 2025-06-12,2025-06-13
+# «пн–пт с 10 до 18 на 12 недель, кроме этих дат». Правило разворачивается здесь
+# в {дата: [время, ...]} и пишется одной транзакцией через availability.save.
+# Слоты почасовые, конец интервала не включается: 10:00-18:00 -> 10:00 … 17:00.
+
+SLOT_MINUTES = 60
+DEFAULT_WEEKS = 4
+MAX_WEEKS = 52
+
+WEEKDAY_NAMES = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+_TIME_RANGE_RE = re.compile(r"^(\d{1,2}:\d{2})[-–—](\d{1,2}:\d{2})$")
+_WEEKS_RE = re.compile(r"^(\d+)w$")
+
+USAGE = (
+    "Usage: /template Mon-Fri 10:00-18:00 [12w] [from 2025-06-02] "
+    "[except 2025-06-12,2025-06-13] [replace]"
+)
+
+
+def _weekday(name: str) -> int:
+    """Mo / Mon / Monday -> 0"""
+    key = name.strip().lower()
+    for index, full in enumerate(WEEKDAY_NAMES):
+        if len(key) >= 2 and full.startswith(key):
+            return index
+    raise ValueError(f"Unknown weekday: {name}")
+
+
+def parse_weekdays(spec: str) -> Set[int]:
+    """'Mon-Fri' / 'Mon,Wed,Fri' / 'Sat-Sun' -> {0..6} (0 — понедельник)"""
+    days = set()
+    for part in spec.split(","):
+        first, sep, last = part.strip().replace("–", "-").partition("-")
+        start = _weekday(first)
+        end = _weekday(last) if sep else start
+        day = start
+        while True:  # диапазон может переходить через воскресенье: Sat-Mon
+            days.add(day)
+            if day == end:
+                break
+            day = (day + 1) % 7
+    return days
+
+
+def _parse_time(value: str) -> int:
+    """'10:00' -> минуты от начала суток"""
+    try:
+        parsed = datetime.strptime(value, "%H:%M")
+    except ValueError:
+        raise ValueError(f"Bad time: {value}") from None
+    return parsed.hour * 60 + parsed.minute
+
+
+def _parse_date(value: str) -> date:
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Bad date: {value} (expected YYYY-MM-DD)") from None
+
+
+def slot_times(start_time: str, end_time: str) -> List[str]:
+    start, end = _parse_time(start_time), _parse_time(end_time)
+    if end <= start:
+        raise ValueError(f"Empty time range: {start_time}-{end_time}")
+    return [f"{m // 60:02d}:{m % 60:02d}" for m in range(start, end, SLOT_MINUTES)]
+
+
+def expand(
+    weekdays: Iterable[int],
+    start_time: str,
+    end_time: str,
+    weeks: int = DEFAULT_WEEKS,
+    start: Optional[date] = None,
+    except_dates: Iterable[date] = (),
+) -> Dict[str, List[str]]:
+    """Правило -> {дата: [время, ...]} на weeks недель, начиная со start (по умолчанию сегодня)"""
+    if not 1 <= weeks <= MAX_WEEKS:
+        raise ValueError(f"Weeks must be between 1 and {MAX_WEEKS}")
+    weekdays = set(weekdays)
+    if not weekdays or not weekdays <= set(range(7)):
+        raise ValueError("Weekdays must be 0..6 (0 — Monday)")
+
+    times = slot_times(start_time, end_time)
+    skip = set(except_dates)
+    start = start or date.today()
+
+    dates_times = {}
+    for offset in range(weeks * 7):
+        day = start + timedelta(days=offset)
+        if day.weekday() in weekdays and day not in skip:
+            dates_times[day.isoformat()] = times
+    return dates_times
+
+
+def parse(text: str) -> dict:
+    """Текст команды бота -> аргументы expand (+ replace)"""
+    words = text.replace(",", " , ").split()
+    if words and words[0].startswith("/"):
+        words = words[1:]
+
+    params: dict = {"weeks": DEFAULT_WEEKS, "except_dates": [], "replace": False}
+    weekday_parts: List[str] = []
+    i = 0
+    while i < len(words):
+        word = words[i]
+        lower = word.lower()
+        time_range = _TIME_RANGE_RE.match(word)
+        weeks = _WEEKS_RE.match(lower)
+
+        if time_range:
+            params["start_time"], params["end_time"] = time_range.groups()
+        elif weeks:
+            params["weeks"] = int(weeks.group(1))
+        elif lower == "from" and i + 1 < len(words):
+            i += 1
+            params["start"] = _parse_date(words[i])
+        elif lower == "except":
+            # даты через запятую/пробел, пока идут слова, начинающиеся с цифры
+            while i + 1 < len(words) and (words[i + 1] == "," or words[i + 1][:1].isdigit()):
+                i += 1
+                if words[i] != ",":
+                    params["except_dates"].append(_parse_date(words[i]))
+        elif lower == "replace":
+            params["replace"] = True
+        else:
+            weekday_parts.append(word)
+        i += 1
+
+    if not weekday_parts or "start_time" not in params:
+        raise ValueError(USAGE)
+    params["weekdays"] = parse_weekdays("".join(weekday_parts))
+    return params
+
+
+async def apply(
+    weekdays: Iterable[int],
+    start_time: str,
+    end_time: str,
+    weeks: int = DEFAULT_WEEKS,
+    start: Optional[date] = None,
+    except_dates: Iterable[date] = (),
+    replace: bool = False,
+) -> Dict[str, object]:
+    """Разворачиваем правило и пишем одной транзакцией"""
+    dates_times = expand(weekdays, start_time, end_time, weeks, start, except_dates)
+    if not dates_times:
+        return {"dates": 0, "first": None, "last": None, "inserted": 0, "removed": 0, "unchanged": 0}
+
+    summary = await availability.save(dates_times, replace=replace)
+    dates = sorted(dates_times)
+    return {"dates": len(dates), "first": dates[0], "last": dates[-1], **summary}
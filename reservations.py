@@ -0,0 +1,67 @@
+import time
+from typing import List, Tuple
+
+import availability
+import db
+import outbox
+
+
+# ============= БРОНИРОВАНИЕ СЛОТОВ =============
+# Слот (дата, время) занимается одной условной записью: INSERT в reservations
+# проходит, только если слот есть в avalible_dates, а UNIQUE(date, time) не даёт
+# второй брони. Заказ в outbox пишется в той же транзакции (BEGIN IMMEDIATE),
+# так что бронь без заказа или заказ без брони невозможны — даже между процессами.
+
+
+class SlotUnavailable(Exception):
+    """Слота нет в расписании или его уже заняли"""
+
+
+async def reserve_and_enqueue(day: str, time_str: str, method: str, payload: dict) -> Tuple[int, int]:
+    """Занимаем слот и ставим заказ в outbox. Возвращаем (id брони, id заказа)"""
+    async with db.write(db.BOOKING) as conn:
+        cur = await conn.execute(
+            """
+            INSERT INTO reservations (date, time, created_at)
+            SELECT ?, ?, ?
+            WHERE EXISTS (SELECT 1 FROM avalible_dates WHERE date = ? AND time = ?)
+              AND NOT EXISTS (SELECT 1 FROM bookings WHERE date = ?)  -- день закрыт через /book
+            ON CONFLICT (date, time) DO NOTHING
+            """,
+            (day, time_str, time.time(), day, time_str, day),
+        )
+        claimed = cur.rowcount == 1
+        reservation_id = cur.lastrowid
+        await cur.close()
+
+        if not claimed:
+            raise SlotUnavailable(f"{day} {time_str}")
+
+        order_id = await outbox.enqueue(method, payload, conn=conn)
+        await conn.execute(
+            "UPDATE reservations SET order_id = ? WHERE id = ?",
+            (order_id, reservation_id),
+        )
+        await availability.bump_version(conn)
+
+    availability.notify(removed=[(day, time_str)])
+    return reservation_id, order_id
+
+
+async def book_days(days: List[str]) -> Tuple[List[str], List[str]]:
+    """Админ закрывает дни целиком (/book). Возвращаем (закрытые сейчас, уже закрытые раньше)"""
+    booked, already = [], []
+    async with db.write(db.BOOKING) as conn:
+        for day in days:
+            cur = await conn.execute(
+                "INSERT INTO bookings (date) VALUES (?) ON CONFLICT (date) DO NOTHING",
+                (day,),
+            )
+            (booked if cur.rowcount == 1 else already).append(day)
+            await cur.close()
+        if booked:
+            await availability.bump_version(conn)
+
+    if booked:
+        availability.notify_resync()
+    return booked, already
@@ -3,14 +3,34 @@ let fp = null;
 
 const timeSelect = document.getElementById("customers-time");
 
+const API = "http://127.0.0.1:8000";
+
 async function loadBookings() {
-  const res = await fetch("http://127.0.0.1:8000/bookings");
+  const res = await fetch(`${API}/bookings`);
   const data = await res.json();
   console.log(data); // для проверки
 
   // берем то, что вернул бэк
   available = data.dates_times || {};
+  renderAvailability();
+}
+
+// дельта из SSE: {"added": {date: [times]}, "removed": {date: [times]}}
+function applyDelta(delta) {
+  for (const [d, times] of Object.entries(delta.added || {})) {
+    const current = new Set(available[d] || []);
+    times.forEach((t) => current.add(t));
+    available[d] = [...current].sort();
+  }
+  for (const [d, times] of Object.entries(delta.removed || {})) {
+    const left = (available[d] || []).filter((t) => !times.includes(t));
+    if (left.length) available[d] = left;
+    else delete available[d];
+  }
+  renderAvailability();
+}
 
+function renderAvailability() {
   // список доступных дат = ключи объекта
   const enabledDates = Object.keys(available); // ["2025-12-18", "2025-12-19"]
 
@@ -25,6 +45,9 @@ async function loadBookings() {
   } else {
     // если данные обновились, можно обновить enable
     fp.set("enable", enabledDates);
+    // и список времени для уже выбранной даты
+    const dateStr = document.getElementById("customers-date").value;
+    if (dateStr) updateTimeOptions(dateStr);
   }
 }
 
@@ -59,5 +82,17 @@ function updateTimeOptions(dateStr) {
   });
 }
 
-loadBookings();
-setInterval(loadBookings, 20000);
+// сервер сам присылает изменения (SSE); EventSource переподключается сам
+// и шлёт Last-Event-ID, так что после обрыва придут только пропущенные события
+if (window.EventSource) {
+  const stream = new EventSource(`${API}/bookings/stream`);
+  stream.addEventListener("snapshot", (e) => {
+    available = JSON.parse(e.data).dates_times || {};
+    renderAvailability();
+  });
+  stream.addEventListener("delta", (e) => applyDelta(JSON.parse(e.data)));
+} else {
+  // старый браузер — опрашиваем как раньше
+  loadBookings();
+  setInterval(loadBookings, 20000);
+}
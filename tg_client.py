@@ -0,0 +1,87 @@
+import os
+from typing import Any, Optional
+
+import httpx
+
+import metrics
+
+
+# ============= ОБЩИЙ КЛИЕНТ TELEGRAM BOT API =============
+# Один долгоживущий httpx.AsyncClient на процесс: соединения с api.telegram.org
+# переиспользуются (keep-alive / HTTP/2), поэтому DNS + TCP + TLS платим один раз,
+# а не на каждый заказ или фото. Создаётся и закрывается в lifespan FastAPI.
+
+_client: Optional[httpx.AsyncClient] = None
+_api_base: str = "https://api.telegram.org"
+_token: Optional[str] = None
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, default))
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, default))
+
+
+async def start(token: Optional[str]) -> httpx.AsyncClient:
+    """Создаём общий клиент (вызывается один раз при старте приложения)"""
+    global _client, _api_base, _token
+
+    if _client is not None:
+        return _client
+
+    _token = token
+    _api_base = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/")
+
+    limits = httpx.Limits(
+        max_connections=_env_int("TG_MAX_CONNECTIONS", 20),
+        max_keepalive_connections=_env_int("TG_MAX_KEEPALIVE", 10),
+        keepalive_expiry=_env_float("TG_KEEPALIVE_EXPIRY", 60.0),
+    )
+    timeout = httpx.Timeout(
+        connect=_env_float("TG_CONNECT_TIMEOUT", 5.0),
+        read=_env_float("TG_READ_TIMEOUT", 15.0),
+        write=_env_float("TG_WRITE_TIMEOUT", 15.0),
+        pool=_env_float("TG_POOL_TIMEOUT", 5.0),
+    )
+
+    transport = httpx.AsyncHTTPTransport(http2=os.getenv("TG_HTTP2", "1") == "1", limits=limits)
+    _client = httpx.AsyncClient(
+        # обёртка считает время ответа, ошибки и 429 по каждому методу Bot API
+        transport=metrics.TelegramMetricsTransport(transport),
+        timeout=timeout,
+    )
+    return _client
+
+
+async def close() -> None:
+    global _client
+
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    if _client is None:
+        raise RuntimeError("Telegram client не запущен (tg_client.start не вызывался)")
+    return _client
+
+
+def api_base() -> str:
+    return _api_base
+
+
+def method_url(method: str) -> str:
+    return f"{_api_base}/bot{_token}/{method}"
+
+
+def file_url(file_path: str) -> str:
+    return f"{_api_base}/file/bot{_token}/{file_path}"
+
+
+async def call(method: str, payload: Optional[dict] = None, **kwargs: Any) -> dict:
+    """POST на метод Bot API, возвращаем распарсенный JSON ответа"""
+    r = await get_client().post(method_url(method), json=payload or {}, **kwargs)
+    return r.json()